@@ -0,0 +1,544 @@
+"""Offline load test for the bot's hot paths.
+
+Runs the real slash command handlers, extraction engine, caches, prefetcher and
+playback loop against fakes: yt-dlp answers from recorded or generated fixtures,
+voice clients play through a thread paced like discord.py's audio player, and a
+sine tone (or a local audio file) replaces the FFmpeg stream. No Discord
+connection or network access is needed.
+
+    python benchmark.py --guilds 50 --duration 60
+"""
+import argparse
+import asyncio
+import copy
+import json
+import logging
+import math
+import os
+import random
+import resource
+import threading
+import time
+from array import array
+from collections import defaultdict
+
+# The benchmark never touches the real state file or the cache directory, and the
+# extraction fakes below can only be patched into thread workers
+os.environ.setdefault('CHANNEL', 'dj-remix')
+os.environ.setdefault('LOG_FILE', 'benchmark.log')
+os.environ['STATE_DB'] = ''
+os.environ['AUDIO_CACHE_DIR'] = ''
+os.environ['EXTRACT_POOL'] = 'thread'
+
+import discord
+import bot as beatsync
+
+FRAME_SECONDS = 0.02  # discord.py sends one 20 ms frame per packet
+
+
+def tone_frame(frequency=440):
+    # One 20 ms frame of 48 kHz 16-bit stereo PCM
+    samples = array('h')
+    for i in range(960):
+        value = int(8000 * math.sin(2 * math.pi * frequency * i / 48000))
+        samples.extend((value, value))
+    return samples.tobytes()
+
+
+class ToneAudio(discord.AudioSource):
+    # Stands in for discord.FFmpegPCMAudio: a fixed-length tone, no process to spawn
+    frame = tone_frame()
+    seconds = 5.0
+
+    def __init__(self, url, **options):
+        self.remaining = int(self.seconds / FRAME_SECONDS)
+
+    def read(self):
+        if self.remaining <= 0:
+            return b''
+        self.remaining -= 1
+        return self.frame
+
+    def cleanup(self):
+        self.remaining = 0
+
+
+class ToneOpusAudio(ToneAudio):
+    # Stands in for discord.FFmpegOpusAudio. The fake voice client never encodes,
+    # so the frames do not have to be real Opus packets
+    def __init__(self, url, *, codec=None, executable=None, **options):
+        super().__init__(url, **options)
+
+    def is_opus(self):
+        return True
+
+
+class FakeYoutubeDL:
+    # Answers extract_info from recorded fixtures, or generates plausible results for
+    # the benchmark's own playlist, watch and search queries
+    def __init__(self, fixtures, extract_delay, entry_delay, audio_file=None):
+        self.fixtures = fixtures  # url or query -> info dict, as written by `yt-dlp -J`
+        self.extract_delay = extract_delay
+        self.entry_delay = entry_delay
+        self.audio_file = audio_file
+
+    def extract_info(self, url, download=False, process=True, ie_key=None):
+        time.sleep(self.extract_delay)
+        data = copy.deepcopy(self.fixtures.get(url)) or self._generate(url)
+        if 'entries' in data:
+            data['entries'] = self._page(data['entries'])
+        elif process:
+            data = self._playable(data)
+        return data
+
+    def process_ie_result(self, data, download=False):
+        # Format selection of an already extracted video, no network involved
+        return self._playable(data)
+
+    def _page(self, entries):
+        # Lazily, like yt-dlp paging through a playlist
+        for entry in entries:
+            time.sleep(self.entry_delay)
+            yield entry
+
+    def _playable(self, data):
+        if self.audio_file:
+            return dict(data, url=self.audio_file, local_file=True)
+        return dict(data, url=f"https://bench.invalid/{data['id']}.webm", acodec='opus', ext='webm')
+
+    def _generate(self, url):
+        if 'list=' in url:
+            # https://www.youtube.com/playlist?list=BENCH<guild>x<size>
+            guild, size = url.split('list=BENCH')[1].split('x')
+            return {'_type': 'playlist', 'entries': [
+                flat_entry(f"g{int(guild):04d}t{index:05d}") for index in range(int(size))]}
+        if 'v=' in url:
+            # A video extracted directly, not a reference to one
+            video_id = url.split('v=')[1][:11]
+            return {'id': video_id, 'title': f"Benchmark track {video_id}", 'webpage_url': url,
+                    'duration': ToneAudio.seconds}
+        # Keyword search, a few hits derived from the query
+        seed = abs(hash(url))
+        return {'_type': 'playlist', 'entries': [flat_entry(f"s{(seed + i) % 10 ** 10:010d}") for i in range(5)]}
+
+
+def flat_entry(video_id):
+    return {'_type': 'url', 'ie_key': 'Youtube', 'id': video_id, 'title': f"Benchmark track {video_id}",
+            'url': f"https://www.youtube.com/watch?v={video_id}", 'duration': ToneAudio.seconds}
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)  # command -> seconds
+        self.first_audio = []  # /play to the first frame handed to the voice client
+        self.gaps = []  # end of one track to the start of the next
+        self.frames = 0
+        self.messages = 0
+        self.errors = 0
+        self.loop_lag = []
+        self.peak_rss = 0
+        self.peak_threads = 0
+
+
+class FakeMessage:
+    ids = iter(range(1, 2 ** 62))
+
+    def __init__(self, stats):
+        self.id = next(self.ids)
+        self.stats = stats
+
+    async def edit(self, **kwargs):
+        self.stats.messages += 1
+        return self
+
+
+class FakeTyping:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class FakeTextChannel:
+    def __init__(self, channel_id, name, stats):
+        self.id = channel_id
+        self.name = name
+        self.stats = stats
+        self.last_message_id = None
+
+    async def send(self, content=None, **kwargs):
+        self.stats.messages += 1
+        message = FakeMessage(self.stats)
+        self.last_message_id = message.id
+        return message
+
+    def typing(self):
+        return FakeTyping()
+
+
+class FakeVoiceChannel:
+    def __init__(self, guild, stats):
+        self.guild = guild
+        self.stats = stats
+        self.members = []
+
+    async def connect(self, **kwargs):
+        self.guild.voice_client = FakeVoiceClient(self.guild, self, self.stats)
+        self.guild.voice_client.play_requested_at = self.guild.play_requested_at
+        return self.guild.voice_client
+
+
+class FakePlayer(threading.Thread):
+    # Same pacing and callback order as discord.player.AudioPlayer
+    def __init__(self, client, after):
+        super().__init__(daemon=True, name='fake-audio-player')
+        self.client = client
+        self.after = after
+        self.stopped = threading.Event()
+        self.resumed = threading.Event()
+        self.resumed.set()
+
+    def run(self):
+        error = None
+        next_at = time.perf_counter()
+        try:
+            while not self.stopped.is_set():
+                if not self.resumed.is_set():
+                    self.resumed.wait()
+                    next_at = time.perf_counter()
+                    continue
+
+                data = self.client.source.read()
+                if not data:
+                    break
+                self.client.played_frame()
+
+                next_at += FRAME_SECONDS
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        except Exception as e:
+            error = e
+        finally:
+            self.client.source.cleanup()
+            self.client.finished()
+            if self.after is not None:
+                self.after(error)
+
+    def stop(self):
+        self.stopped.set()
+        self.resumed.set()
+
+
+class FakeVoiceClient:
+    def __init__(self, guild, channel, stats):
+        self.guild = guild
+        self.channel = channel
+        self.stats = stats
+        self.source = None
+        self.player = None
+        self.connected = True
+        self.play_requested_at = None  # Set by the benchmark when /play is issued
+        self.transition_from = None  # End of a track that has a successor queued
+
+    def play(self, source, *, after=None):
+        if self.is_playing():
+            raise discord.ClientException('Already playing audio.')
+        if self.transition_from is not None:
+            self.stats.gaps.append(time.perf_counter() - self.transition_from)
+            self.transition_from = None
+        self.source = source
+        self.player = FakePlayer(self, after)
+        self.player.start()
+
+    def played_frame(self):
+        self.stats.frames += 1
+        if self.play_requested_at is not None:
+            self.stats.first_audio.append(time.perf_counter() - self.play_requested_at)
+            self.play_requested_at = None
+
+    def finished(self):
+        # Only gaps between queued tracks count as transitions, not the wait for a new /play
+        if self.connected and beatsync.bot.get_session(self.guild.id).queue:
+            self.transition_from = time.perf_counter()
+
+    def is_connected(self):
+        return self.connected
+
+    def is_playing(self):
+        return self.player is not None and self.player.is_alive() and self.player.resumed.is_set() \
+            and not self.player.stopped.is_set()
+
+    def is_paused(self):
+        return self.player is not None and self.player.is_alive() and not self.player.resumed.is_set()
+
+    def pause(self):
+        if self.player is not None:
+            self.player.resumed.clear()
+
+    def resume(self):
+        if self.player is not None:
+            self.player.resumed.set()
+
+    def stop(self):
+        if self.player is not None:
+            self.player.stop()
+
+    async def disconnect(self, *, force=False):
+        self.connected = False
+        self.stop()
+        self.guild.voice_client = None
+
+
+class FakeGuild:
+    def __init__(self, guild_id, stats):
+        self.id = guild_id
+        self.name = f"Benchmark {guild_id}"
+        self.text_channels = [FakeTextChannel(guild_id, os.getenv('CHANNEL'), stats)]
+        self.voice_channel = FakeVoiceChannel(self, stats)
+        self.voice_client = None
+        self.play_requested_at = None
+
+
+class FakeResponse:
+    def __init__(self, stats):
+        self.stats = stats
+        self.done = False
+
+    def is_done(self):
+        return self.done
+
+    async def send_message(self, content=None, **kwargs):
+        self.done = True
+        self.stats.messages += 1
+
+    async def defer(self, **kwargs):
+        self.done = True
+
+    async def edit_message(self, **kwargs):
+        self.done = True
+        self.stats.messages += 1
+
+
+class FakeFollowup:
+    def __init__(self, stats):
+        self.stats = stats
+
+    async def send(self, content=None, *, wait=False, **kwargs):
+        self.stats.messages += 1
+        return FakeMessage(self.stats)
+
+
+class FakeUser:
+    bot = False
+
+    def __init__(self, user_id, voice_channel):
+        self.id = user_id
+        self.voice = argparse.Namespace(channel=voice_channel)
+
+
+class FakeInteraction:
+    def __init__(self, guild, user, stats):
+        self.guild = guild
+        self.user = user
+        self.channel = guild.text_channels[0]
+        self.response = FakeResponse(stats)
+        self.followup = FakeFollowup(stats)
+
+
+async def invoke(command, guild, user, stats, label=None, *args):
+    interaction = FakeInteraction(guild, user, stats)
+    started = time.perf_counter()
+    try:
+        await command.callback(interaction, *args)
+    except Exception as e:
+        stats.errors += 1
+        beatsync.logger.warning(f"{command.name} failed in guild {guild.id}: {e}")
+    stats.latencies[label or command.name].append(time.perf_counter() - started)
+
+
+async def run_guild(index, args, stats, deadline):
+    rng = random.Random(args.seed + index)
+    guild = FakeGuild(index + 1, stats)
+    user = FakeUser(1000 + index, guild.voice_channel)
+    loop = asyncio.get_running_loop()
+
+    async def play(query, label):
+        voice_client = guild.voice_client
+        if voice_client is None:
+            guild.play_requested_at = time.perf_counter()  # Handed to the voice client on connect
+        elif not voice_client.is_playing() and not voice_client.is_paused():
+            voice_client.play_requested_at = time.perf_counter()
+        await invoke(beatsync.play, guild, user, stats, label, query)
+
+    playlist = f"https://www.youtube.com/playlist?list=BENCH{index + 1}x{args.playlist_size}"
+    play_task = asyncio.ensure_future(play(playlist, 'play (playlist)'))
+
+    # The playlist keeps being ingested while the guild issues other commands
+    while loop.time() < deadline:
+        await asyncio.sleep(rng.uniform(0.5, 1.5) * args.think)
+        choice = rng.random()
+        if choice < 0.45:
+            await invoke(beatsync.queue, guild, user, stats)
+        elif choice < 0.6:
+            await play(f"benchmark search {rng.randrange(args.searches)}", 'play (search)')
+        elif choice < 0.7:
+            video_id = f"v{index + 1:04d}x{rng.randrange(10 ** 5):05d}"
+            await play(f"https://www.youtube.com/watch?v={video_id}", 'play (video)')
+        elif choice < 0.85:
+            if guild.voice_client is not None and guild.voice_client.is_playing():
+                await invoke(beatsync.skip, guild, user, stats)
+        else:
+            if guild.voice_client is not None and guild.voice_client.is_playing():
+                await invoke(beatsync.volume, guild, user, stats, None, rng.randrange(1, 100))
+
+    await play_task
+    if guild.voice_client is not None:
+        await invoke(beatsync.stop, guild, user, stats)
+        await guild.voice_client.disconnect()
+
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Peak, not current
+
+
+async def sample(stats, stopped):
+    # Event loop lag, memory and thread count, every 100 ms
+    loop = asyncio.get_running_loop()
+    while not stopped.is_set():
+        expected = loop.time() + 0.1
+        await asyncio.sleep(0.1)
+        stats.loop_lag.append(max(0.0, loop.time() - expected))
+        stats.peak_rss = max(stats.peak_rss, rss_bytes())
+        stats.peak_threads = max(stats.peak_threads, threading.active_count())
+
+
+def install_fakes(args):
+    fixtures = {}
+    if args.fixtures:
+        with open(args.fixtures) as f:
+            fixtures = json.load(f)
+    fake_ytdl = FakeYoutubeDL(fixtures, args.extract_ms / 1000, args.entry_ms / 1000, args.audio_file)
+    beatsync.worker_ytdl = lambda flat=False: fake_ytdl
+
+    ToneAudio.seconds = args.track_seconds
+    if not args.audio_file:
+        discord.FFmpegPCMAudio = ToneAudio
+        discord.FFmpegOpusAudio = ToneOpusAudio
+
+
+async def run(args):
+    install_fakes(args)
+    stats = Stats()
+    async with beatsync.bot:
+        loop = asyncio.get_running_loop()
+        baseline_rss = rss_bytes()
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+
+        stopped = asyncio.Event()
+        sampler = asyncio.ensure_future(sample(stats, stopped))
+        deadline = loop.time() + args.duration
+        await asyncio.gather(*(run_guild(index, args, stats, deadline) for index in range(args.guilds)))
+        stopped.set()
+        await sampler
+
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+    return report(args, stats, elapsed, cpu, baseline_rss)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summary(values):
+    return {'count': len(values), 'p50': percentile(values, 0.5), 'p99': percentile(values, 0.99),
+            'max': max(values) if values else None}
+
+
+def report(args, stats, elapsed, cpu, baseline_rss):
+    commands = sum(len(latencies) for latencies in stats.latencies.values())
+    return {
+        'guilds': args.guilds,
+        'seconds': elapsed,
+        'commands': commands,
+        'commands_per_second': commands / elapsed,
+        'errors': stats.errors,
+        'messages': stats.messages,
+        'frames': stats.frames,
+        'frames_per_guild_second': stats.frames / elapsed / args.guilds,  # 50 is real time
+        'underruns': beatsync.BufferedAudio.total_underruns,
+        'latency': {name: summary(latencies) for name, latencies in sorted(stats.latencies.items())},
+        'first_audio': summary(stats.first_audio),
+        'transition_gap': summary(stats.gaps),
+        'loop_lag': summary(stats.loop_lag),
+        'cpu_seconds': cpu,
+        'cpu_per_guild': cpu / elapsed / args.guilds,  # Fraction of one core
+        'peak_rss_mb': stats.peak_rss / 2 ** 20,
+        'rss_per_guild_mb': max(0, stats.peak_rss - baseline_rss) / 2 ** 20 / args.guilds,
+        'peak_threads': stats.peak_threads,
+        'extraction_cache': {'stream': beatsync.stream_cache.stats(), 'search': beatsync.search_cache.stats()},
+    }
+
+
+def ms(value):
+    return '-' if value is None else f"{value * 1000:.1f}"
+
+
+def print_report(result):
+    print(f"guilds             {result['guilds']}")
+    print(f"duration           {result['seconds']:.1f} s")
+    print(f"commands           {result['commands']} ({result['commands_per_second']:.1f}/s, "
+          f"{result['errors']} errors)")
+    print(f"audio frames       {result['frames']} ({result['frames_per_guild_second']:.1f}/s per guild, "
+          f"{result['underruns']} underruns)")
+    print(f"peak threads       {result['peak_threads']}")
+    print(f"cpu                {result['cpu_seconds']:.2f} s, {result['cpu_per_guild'] * 100:.2f}% of a core per guild")
+    print(f"memory             {result['peak_rss_mb']:.1f} MB peak, {result['rss_per_guild_mb']:.2f} MB per guild")
+    print(f"caches             stream {result['extraction_cache']['stream']}, "
+          f"search {result['extraction_cache']['search']}")
+    print()
+    print(f"{'ms':<20}{'count':>8}{'p50':>10}{'p99':>10}{'max':>10}")
+    rows = [(f"/{name}", values) for name, values in result['latency'].items()]
+    rows += [('first audio', result['first_audio']), ('transition gap', result['transition_gap']),
+             ('event loop lag', result['loop_lag'])]
+    for name, values in rows:
+        print(f"{name:<20}{values['count']:>8}{ms(values['p50']):>10}{ms(values['p99']):>10}{ms(values['max']):>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for BeatSync")
+    parser.add_argument('--guilds', type=int, default=20, help="Guilds issuing commands at the same time")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds each guild keeps issuing commands")
+    parser.add_argument('--playlist-size', type=int, default=50, help="Entries in each guild's playlist")
+    parser.add_argument('--track-seconds', type=float, default=5, help="Length of every track")
+    parser.add_argument('--extract-ms', type=float, default=150, help="Simulated yt-dlp extraction time")
+    parser.add_argument('--entry-ms', type=float, default=5, help="Simulated time per flat playlist entry")
+    parser.add_argument('--searches', type=int, default=10, help="Distinct search queries shared by all guilds")
+    parser.add_argument('--think', type=float, default=1.0, help="Scale of the pause between commands")
+    parser.add_argument('--fixtures', help="JSON file mapping URLs and queries to recorded yt-dlp results")
+    parser.add_argument('--audio-file', help="Play this file through real FFmpeg instead of a generated tone")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help="Print the results as JSON")
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(args.log_level)
+    result = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,86 @@
+import time
+
+# Taken before the other imports so the startup log covers them
+STARTED_AT = time.monotonic()
+
 import asyncio
+import atexit
+import contextvars
+import difflib
+import hashlib
 import logging
+import logging.handlers
 import os
 import discord
 import yt_dlp as youtube_dl
 import random
+import heapq
+import itertools
+import json
+import sqlite3
 import re
+import signal
+import sys
+import threading
+import unicodedata
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from queue import SimpleQueue
+from urllib.parse import parse_qs, urlparse
 from discord.ext import commands
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("bot.log"),
-        logging.StreamHandler()
-    ]
-)
+# Records are put on a queue and written by a background thread, so log calls never wait for the disk
+LOG_FILE = os.getenv('LOG_FILE', 'bot.log')
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_MB', '10')) * 1024 * 1024
+LOG_BACKUPS = int(os.getenv('LOG_BACKUPS', '5'))
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')  # text or json
+
+# Set by commands and playback, copied into every record logged from the same task
+log_guild_id = contextvars.ContextVar('log_guild_id', default=None)
+log_track_id = contextvars.ContextVar('log_track_id', default=None)
+
+
+class LogContextFilter(logging.Filter):
+    # Runs in the caller before the record is queued, while the task's context is still visible
+    def filter(self, record):
+        record.guild_id = log_guild_id.get()
+        record.track_id = log_track_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {'time': self.formatTime(record), 'level': record.levelname, 'logger': record.name,
+                 'message': record.getMessage()}
+        for field in ('guild_id', 'track_id'):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        return json.dumps(entry, ensure_ascii=False)
+
+
+log_queue = SimpleQueue()
+queue_handler = logging.handlers.QueueHandler(log_queue)
+queue_handler.addFilter(LogContextFilter())
+# Only the message is rendered here, the handlers behind the queue add the rest
+logging.basicConfig(level=logging.INFO, format='%(message)s', handlers=[queue_handler])
+
+if LOG_FORMAT == 'json':
+    log_formatter = JsonFormatter()
+else:
+    log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+log_handlers = [
+    logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS,
+                                         encoding='utf-8'),
+    logging.StreamHandler()
+]
+for handler in log_handlers:
+    handler.setFormatter(log_formatter)
+log_listener = logging.handlers.QueueListener(log_queue, *log_handlers)
+log_listener.start()
+atexit.register(log_listener.stop)  # Writes out what is still queued
 
 logger = logging.getLogger(__name__)
 
@@ -23,27 +88,395 @@ logger = logging.getLogger(__name__)
 intents = discord.Intents.default()
 intents.message_content = True
 intents.voice_states = True
-disconnected = False
 
-currentSong = {}
+DEFAULT_VOLUME = 0.05
+
+
+class Track:
+    # Compact queue record: what is needed to list a song and resolve it when it is about to play
+    __slots__ = ('title', 'url', 'id', 'duration')
+
+    def __init__(self, title, url, id=None, duration=None):
+        self.title = title
+        self.url = url  # Page URL, the stream URL is resolved at play time
+        self.id = id
+        self.duration = duration
+
+    @classmethod
+    def from_entry(cls, entry):
+        # Build a track from a (possibly flat) extractor entry
+        url = entry.get('webpage_url') or entry.get('url')
+        return cls(entry.get('title') or url, url, entry.get('id'), entry.get('duration'))
+
+    def copy(self):
+        return Track(self.title, self.url, self.id, self.duration)
+
+
+class TrackQueue:
+    # Upcoming tracks: a deque for cheap appends and pops at both ends, plus an index of
+    # track keys for O(1) duplicate checks
+    __slots__ = ('tracks', 'keys', 'total_duration', 'unknown_durations')
+
+    def __init__(self, tracks=()):
+        self.tracks = deque()
+        self.keys = set()
+        self.total_duration = 0  # Seconds, kept up to date so /queue never has to sum the queue
+        self.unknown_durations = 0  # Tracks without a known duration
+        for track in tracks:
+            self.append(track)
+
+    @staticmethod
+    def key(track):
+        return track.id or track.url
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def __iter__(self):
+        return iter(self.tracks)
+
+    def __getitem__(self, position):
+        return self.tracks[position]
+
+    def __contains__(self, track):
+        return self.key(track) in self.keys
+
+    def append(self, track):
+        # Returns False without adding when the track is already queued
+        key = self.key(track)
+        if key in self.keys:
+            return False
+        self.tracks.append(track)
+        self.keys.add(key)
+        self._count(track, 1)
+        return True
+
+    def appendleft(self, track):
+        # Puts a track back at the head, e.g. one that was popped but could not be started
+        key = self.key(track)
+        if key in self.keys:
+            return False
+        self.tracks.appendleft(track)
+        self.keys.add(key)
+        self._count(track, 1)
+        return True
+
+    def popleft(self):
+        track = self.tracks.popleft()
+        self.keys.discard(self.key(track))
+        self._count(track, -1)
+        return track
+
+    def remove(self, position):
+        track = self.tracks[position]
+        del self.tracks[position]
+        self.keys.discard(self.key(track))
+        self._count(track, -1)
+        return track
+
+    def page(self, start, stop):
+        # Only walks the requested window of the deque
+        return list(itertools.islice(self.tracks, start, stop))
+
+    def move(self, source, destination):
+        track = self.tracks[source]
+        del self.tracks[source]
+        self.tracks.insert(destination, track)
+        return track
+
+    def shuffle(self):
+        tracks = list(self.tracks)
+        random.shuffle(tracks)
+        self.tracks = deque(tracks)
+
+    def clear(self):
+        self.tracks.clear()
+        self.keys.clear()
+        self.total_duration = 0
+        self.unknown_durations = 0
+
+    def _count(self, track, sign):
+        if track.duration:
+            self.total_duration += sign * track.duration
+        else:
+            self.unknown_durations += sign
+
+
+class GuildSession:
+    # Everything the bot keeps for one server
+    __slots__ = ('guild_id', 'queue', 'current', 'volume', 'listeners', 'paused_alone',
+                 'game_active', 'game_track', 'guess_attempts', 'play_lock')
+
+    def __init__(self, guild_id):
+        self.guild_id = guild_id
+        self.queue = TrackQueue()  # Upcoming tracks
+        self.current = None  # Track playing now
+        self.volume = DEFAULT_VOLUME
+        self.listeners = None  # Non-bot members in the bot's voice channel, None until counted
+        self.paused_alone = False  # Playback was paused because everyone left
+        self.game_active = False  # 'Guess the Song' state
+        self.game_track = None  # GameTrack being guessed
+        self.guess_attempts = 0
+        self.play_lock = asyncio.Lock()  # Held while play_next_song pops and starts a track
+
+
+# Cold start timing: each phase is logged with its own duration and the total so far
+startup_phases = {}
+last_phase_at = STARTED_AT
+
+
+def startup_phase(name):
+    global last_phase_at
+    now = time.monotonic()
+    startup_phases[name] = now - last_phase_at
+    last_phase_at = now
+    logger.info(f"Startup phase '{name}' took {startup_phases[name]:.2f} s ({now - STARTED_AT:.2f} s since start)")
+
+
+# Hash of the synced slash command definitions, to skip the rate limited global sync when nothing changed
+COMMAND_HASH_FILE = os.getenv('COMMAND_HASH_FILE', '.command_tree_hash')
 
-guessing_game_active = {}
-song_title_masked = {}
-guess_attempts = {}
+
+def command_tree_hash(tree):
+    payload = []
+    for command in sorted(tree.get_commands(), key=lambda command: command.name):
+        try:
+            payload.append(command.to_dict(tree))
+        except TypeError:
+            payload.append(command.to_dict())  # discord.py before 2.4 takes no tree argument
+    data = json.dumps({'application_id': os.getenv('APP'), 'commands': payload}, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def read_command_hash():
+    try:
+        with open(COMMAND_HASH_FILE) as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+
+def write_command_hash(digest):
+    try:
+        with open(COMMAND_HASH_FILE, 'w') as file:
+            file.write(digest)
+    except OSError as e:
+        logger.info(f"Could not save the command tree hash: {e}")
+
+
+# Prometheus metrics and health checks served over HTTP, METRICS_PORT=0 disables the endpoint
+METRICS_PORT = int(os.getenv('METRICS_PORT', '8080'))
+HEALTH_MAX_LOOP_LAG = float(os.getenv('HEALTH_MAX_LOOP_LAG', '1'))  # Seconds before /healthz reports unhealthy
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    # Prometheus histogram with fixed buckets
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+        metrics.append(self)
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for bound, count in zip(self.buckets, self.counts):
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {count}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+class Gauge:
+    # Value read from a callback at scrape time, so nothing has to be updated on hot paths
+    def __init__(self, name, help, read, kind='gauge'):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.kind = kind  # 'gauge' or 'counter'
+        metrics.append(self)
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", f"{self.name} {self.read()}"]
+
+
+metrics = []
+extraction_seconds = Histogram('beatsync_extraction_seconds', 'yt-dlp extraction time for tracks and searches')
+from_url_seconds = Histogram('beatsync_from_url_seconds', 'YTDLSource.from_url time, resolving plus starting FFmpeg')
+first_audio_seconds = Histogram('beatsync_time_to_first_audio_seconds', 'Time from /play until its first track plays')
+transition_seconds = Histogram('beatsync_track_transition_seconds', 'Time play_next_song takes to start the next track')
+loop_lag_seconds = Histogram('beatsync_event_loop_lag_seconds', 'Event loop scheduling delay',
+                             (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+ffmpeg_sources = weakref.WeakSet()  # FFmpeg audio sources, for counting live processes
+loop_lag = 0
+
+
+def live_ffmpeg_processes():
+    return sum(1 for source in list(ffmpeg_sources)
+               if getattr(source, '_process', None) is not None and source._process.poll() is None)
+
+
+def render_metrics():
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def monitor_loop_lag(interval=0.5):
+    # How late the loop wakes us up is how long everything else waited for it
+    global loop_lag
+    loop = asyncio.get_event_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        loop_lag = max(0, loop.time() - started - interval)
+        loop_lag_seconds.observe(loop_lag)
+
+
+async def bot_http_response(path):
+    if path == '/metrics':
+        return '200 OK', render_metrics()
+    if path == '/healthz':
+        if not bot.is_closed() and loop_lag < HEALTH_MAX_LOOP_LAG:
+            return '200 OK', 'ok\n'
+        return '503 Service Unavailable', f'event loop lag {loop_lag:.3f} s\n'
+    if path == '/ready':
+        return ('200 OK', 'ready\n') if bot.is_ready() else ('503 Service Unavailable', 'starting\n')
+    return '404 Not Found', 'not found\n'
+
+
+async def handle_http(reader, writer, respond=bot_http_response):
+    # Minimal HTTP/1.0 responder: /metrics for Prometheus, /healthz for liveness, /ready for readiness
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        parts = request_line.decode('latin-1').split()
+        path = parts[1] if len(parts) > 1 else '/'
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b'\r\n', b'\n', b''):
+            pass  # Skip the headers
+
+        status, body = await respond(path)
+        if path == '/metrics':
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            content_type = 'text/plain; charset=utf-8'
+
+        payload = body.encode()
+        writer.write(f"HTTP/1.0 {status}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server():
+    if not METRICS_PORT:
+        return
+    await asyncio.start_server(handle_http, '0.0.0.0', METRICS_PORT)
+    asyncio.get_event_loop().create_task(monitor_loop_lag())
+    logger.info(f"Serving metrics and health checks on port {METRICS_PORT}")
+
+
+# Read at scrape time, the objects behind them are defined further down
+Gauge('beatsync_voice_sessions', 'Connected voice clients', lambda: len(bot.voice_clients))
+Gauge('beatsync_queued_tracks', 'Tracks queued across all guilds',
+      lambda: sum(len(session.queue) for session in bot.sessions.values()))
+Gauge('beatsync_longest_queue', 'Length of the longest guild queue',
+      lambda: max((len(session.queue) for session in bot.sessions.values()), default=0))
+Gauge('beatsync_ffmpeg_processes', 'Live FFmpeg processes', live_ffmpeg_processes)
+Gauge('beatsync_event_loop_lag_last_seconds', 'Last measured event loop lag', lambda: loop_lag)
+Gauge('beatsync_extractions_waiting', 'Extractions waiting for a worker',
+      lambda: sum(1 for *_, future in extraction.waiting if not future.done()))
+Gauge('beatsync_extractions_running', 'Extractions running on a worker', lambda: extraction.active)
+Gauge('beatsync_stream_cache_hits_total', 'Stream cache hits', lambda: stream_cache.hits, 'counter')
+Gauge('beatsync_stream_cache_misses_total', 'Stream cache misses', lambda: stream_cache.misses, 'counter')
+Gauge('beatsync_search_cache_hits_total', 'Search cache hits', lambda: search_cache.hits, 'counter')
+Gauge('beatsync_search_cache_misses_total', 'Search cache misses', lambda: search_cache.misses, 'counter')
+Gauge('beatsync_readahead_min_fill_ratio', 'Lowest fill level of the read-ahead buffers still being filled',
+      lambda: min((buffer.fill_level for buffer in list(BufferedAudio.active) if not buffer.finished), default=1))
+Gauge('beatsync_audio_underruns_total', 'Read-ahead buffer underruns', lambda: BufferedAudio.total_underruns,
+      'counter')
+
+
+# Sharding. With WORKERS=1 one process runs every shard. With more, the process started first
+# becomes a supervisor that runs WORKERS worker processes, each owning every WORKERS-th shard
+WORKERS = int(os.getenv('WORKERS', '1'))
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '0')) or (WORKERS if WORKERS > 1 else 0)  # 0: Discord decides
+WORKER_INDEX = int(os.getenv('WORKER_INDEX', '0'))  # Set by the supervisor for its workers
+SUPERVISOR = WORKERS > 1 and 'WORKER_INDEX' not in os.environ
+WORKER_RESTART_DELAY = float(os.getenv('WORKER_RESTART_DELAY', '5'))
+
+
+def worker_shard_ids():
+    return [shard_id for shard_id in range(SHARD_COUNT) if shard_id % WORKERS == WORKER_INDEX]
 
 
 # Create bot instance with command tree for slash commands
-class MyBot(commands.Bot):
+class MyBot(commands.AutoShardedBot):
     def __init__(self):
-        super().__init__(command_prefix="!", intents=intents, application_id=os.getenv('APP'))
-        self.song_queue = {}  # A dictionary to keep track of playlists per server
-        self.current_volume = {}  # A dictionary to store volume per server
-        self.disconnect_timer = {}  # Dictionary to track timers for disconnection
+        shards = {}
+        if SHARD_COUNT:
+            shards = {'shard_count': SHARD_COUNT, 'shard_ids': worker_shard_ids()}
+        super().__init__(command_prefix="!", intents=intents, application_id=os.getenv('APP'), **shards)
+        self.sessions = {}  # guild id -> GuildSession
+        self.restored = False  # Saved sessions are resumed on the first on_ready only
+
+    def get_session(self, guild_id):
+        session = self.sessions.get(guild_id)
+        if session is None:
+            session = self.sessions[guild_id] = GuildSession(guild_id)
+            state_store.restore(session)  # Pick up the queue saved before a restart
+        return session
 
     async def setup_hook(self):
-        # Sync the slash commands with Discord
-        await bot.tree.sync()
-        logger.info("Slash commands have been synchronized.")
+        # setup_hook runs right after the login, before anything else is started
+        startup_phase('login')
+
+        # One task runs every guild's inactivity timer
+        self.loop.create_task(idle_scheduler.run())
+        await start_metrics_server()
+
+        # Keep 'Guess the Song' tracks ready
+        self.loop.create_task(game_pool.run())
+
+        # Load saved sessions and keep saving them in the background
+        await state_store.open()
+        self.loop.create_task(state_store.run())
+        startup_phase('restore')
+
+        # Sync the slash commands with Discord, only when their definitions changed since the last sync.
+        # Commands are global, so only the first worker syncs them
+        digest = command_tree_hash(self.tree)
+        if WORKER_INDEX != 0:
+            logger.info("Slash commands are synchronized by worker 0.")
+        elif os.getenv('FORCE_SYNC') == '1' or read_command_hash() != digest:
+            await bot.tree.sync()
+            write_command_hash(digest)
+            logger.info("Slash commands have been synchronized.")
+        else:
+            logger.info("Slash commands are unchanged, skipped synchronizing.")
+        startup_phase('sync')
+
+    async def close(self):
+        # Save the latest queues and positions before the voice connections go away
+        try:
+            await state_store.flush()
+        except Exception as e:
+            logger.info(f"Saving sessions failed: {e}")
+        await super().close()
 
 # Create bot instance
 bot = MyBot()
@@ -73,45 +506,1023 @@ ffmpeg_options = {
     'options': '-vn'
 }
 
-ytdl = youtube_dl.YoutubeDL(ytdl_format_options)
+# 'opus': FFmpeg outputs Opus (copied or encoded with a volume filter), 'pcm': decode and scale in Python
+AUDIO_MODE = os.getenv('AUDIO_MODE', 'opus')
+
+# Tracks played AUDIO_CACHE_MIN_PLAYS times are kept on disk, evicting least recently played above the size cap.
+# An empty AUDIO_CACHE_DIR disables the disk cache
+AUDIO_CACHE_DIR = os.getenv('AUDIO_CACHE_DIR', '')
+AUDIO_CACHE_MIN_PLAYS = int(os.getenv('AUDIO_CACHE_MIN_PLAYS', '3'))
+AUDIO_CACHE_MAX_MB = int(os.getenv('AUDIO_CACHE_MAX_MB', '2048'))
+
+# Seconds without playback before the bot leaves the voice channel
+IDLE_TIMEOUT = int(os.getenv('IDLE_TIMEOUT', '120'))
+
+# Songs per /queue page and how long its buttons stay active
+QUEUE_PAGE_SIZE = 10
+QUEUE_VIEW_TIMEOUT = 300
+
+# Queues, current track, position and volume are saved here and restored after a restart.
+# An empty STATE_DB disables persistence
+STATE_DB = os.getenv('STATE_DB', 'state.db')
+STATE_FLUSH_INTERVAL = float(os.getenv('STATE_FLUSH_INTERVAL', '5'))
+RESTORE_INTERVAL = float(os.getenv('RESTORE_INTERVAL', '1'))  # Seconds between guilds resumed at startup
+
+# Seconds of audio read ahead of the voice player to ride out network stalls, 0 disables the buffer
+READAHEAD_SECONDS = float(os.getenv('READAHEAD_SECONDS', '5'))
+
+# Minimum seconds between edits of the "Added N songs" message while a playlist is ingested
+PLAYLIST_STATUS_INTERVAL = 2
+
+# Channel messages and the bot's presence are sent by the Notifier, never straight from playback
+NOTIFY_INTERVAL = float(os.getenv('NOTIFY_INTERVAL', '2'))  # Minimum seconds between messages in one channel
+PRESENCE_INTERVAL = float(os.getenv('PRESENCE_INTERVAL', '60'))  # Seconds between presence refreshes
+IDLE_PRESENCE = "Doing nothing. Use /play to use me."
+
+# Resolved stream URLs are cached per video until shortly before their signed expiry
+STREAM_CACHE_SIZE = int(os.getenv('STREAM_CACHE_SIZE', '512'))
+STREAM_CACHE_DEFAULT_TTL = 1800  # Used when the stream URL carries no expire= parameter
+STREAM_EXPIRY_MARGIN = 60  # Never hand out a URL that expires within this many seconds
+
+# Keyword search results are cached per normalized query
+SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', '256'))
+SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', '3600'))
+
+# Playlists are listed flat: entries carry title and page URL, streams are resolved at play time
+ytdl_flat_options = dict(ytdl_format_options, extract_flat='in_playlist')
+
+# Extraction workers: 'thread' or 'process' pool, global and per-guild caps on concurrent extractions
+EXTRACT_POOL = os.getenv('EXTRACT_POOL', 'thread')
+EXTRACT_WORKERS = int(os.getenv('EXTRACT_WORKERS', '4'))
+EXTRACT_GUILD_LIMIT = int(os.getenv('EXTRACT_GUILD_LIMIT', '2'))
+PLAYLIST_WORKERS = int(os.getenv('PLAYLIST_WORKERS', '2'))  # Concurrent flat playlist listings
+PLAYLIST_CHUNK_SIZE = int(os.getenv('PLAYLIST_CHUNK_SIZE', '50'))  # Entries listed per turn on a playlist thread
+
+# Extraction priorities, lower runs first
+PRIORITY_PLAY = 0  # The track that has to start playing now
+PRIORITY_SEARCH = 1  # Interactive keyword searches
+PRIORITY_PREFETCH = 2  # Resolving ahead of time
+
+# 'Guess the Song' tracks searched and resolved in the background, ready for the next game
+GAME_POOL_SIZE = int(os.getenv('GAME_POOL_SIZE', '20'))
+GAME_SEARCH_RESULTS = 10  # Search hits fetched per random phrase
+GUESS_MATCH_THRESHOLD = float(os.getenv('GUESS_MATCH_THRESHOLD', '0.75'))  # Token F1 score a guess needs
+
+# YoutubeDL instances are not thread safe, every worker thread or process gets its own
+worker_state = threading.local()
+
+
+def worker_ytdl(flat=False):
+    name = 'ytdl_flat' if flat else 'ytdl'
+    instance = getattr(worker_state, name, None)
+    if instance is None:
+        instance = youtube_dl.YoutubeDL(ytdl_flat_options if flat else ytdl_format_options)
+        setattr(worker_state, name, instance)
+    return instance
+
+
+def stream_data(data):
+    # The fields playback needs from a fully extracted video. Formats, thumbnails and captions
+    # are dropped, so cached entries stay small and cheap to send back from a worker process
+    return {'_type': 'video', 'id': data.get('id'), 'title': data.get('title'), 'url': data.get('url'),
+            'webpage_url': data.get('webpage_url'), 'duration': data.get('duration'), 'acodec': data.get('acodec')}
+
+
+def extract_track(url):
+    # Runs in an extraction worker
+    data = worker_ytdl().extract_info(url, download=False)
+
+    if 'entries' in data:
+        # Search results come back as a playlist, play the first hit
+        data = data['entries'][0]
+
+    return stream_data(data)
+
+
+def extract_flat_entries(query):
+    # Runs in an extraction worker
+    return [youtube_dl.YoutubeDL.sanitize_info(entry) for entry in iter_flat_entries(query)]
+
+
+def download_track(url, directory):
+    # Runs in the audio cache worker. Keeps the audio stream only, as Opus in an Ogg file
+    # (copied without re-encoding when YouTube serves Opus already)
+    options = dict(ytdl_format_options, noplaylist=True, outtmpl=os.path.join(directory, '%(id)s.%(ext)s'),
+                   postprocessors=[{'key': 'FFmpegExtractAudio', 'preferredcodec': 'opus'}])
+    with youtube_dl.YoutubeDL(options) as ytdl_download:
+        data = ytdl_download.extract_info(url, download=True)
+    return os.path.join(directory, f"{data['id']}.opus"), data.get('title')
+
+
+class LRUCache:
+    # Size-bounded LRU mapping with a per-entry expiry time and hit/miss counters
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        item = self.entries.get(key)
+        if item is not None and item[0] <= time.time():
+            del self.entries[key]  # Expired
+            item = None
+
+        if item is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def __contains__(self, key):
+        # Whether key holds an unexpired value, without touching the order or the counters
+        item = self.entries.get(key)
+        return item is not None and item[0] > time.time()
+
+    def put(self, key, value, expires_at):
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0
+        return (f"size={len(self.entries)}/{self.max_size} hits={self.hits} misses={self.misses} "
+                f"evictions={self.evictions} hit_rate={hit_rate:.0%}")
+
+
+YOUTUBE_ID_RE = re.compile(r'(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/)([0-9A-Za-z_-]{11})')
+
+
+def is_single_video_url(url):
+    # YouTube video links without a playlist attached, anything else may list several tracks
+    return YOUTUBE_ID_RE.search(url) is not None and 'list' not in parse_qs(urlparse(url).query)
+
+
+def cache_key(url):
+    # Key YouTube tracks by video ID so page URLs, short links and shorts share an entry
+    match = YOUTUBE_ID_RE.search(url)
+    return match.group(1) if match else url
+
+
+def stream_expiry(data):
+    # Signed googlevideo URLs carry their expiry as a unix timestamp in expire=
+    expire = parse_qs(urlparse(data.get('url', '')).query).get('expire')
+    if expire and expire[0].isdigit():
+        return int(expire[0]) - STREAM_EXPIRY_MARGIN
+    return time.time() + STREAM_CACHE_DEFAULT_TTL
+
+
+def remember_stream(key, data):
+    # Cache resolved track data under the lookup key and the video id
+    expires_at = stream_expiry(data)
+    stream_cache.put(key, data, expires_at)
+    if data.get('id') and data['id'] != key:
+        stream_cache.put(data['id'], data, expires_at)
+
+
+class SingleFlight:
+    # Coalesces concurrent calls for the same key into a single in-flight call
+    def __init__(self):
+        self.calls = {}  # key -> task
+
+    async def do(self, key, func):
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self.calls[key] = task
+            task.add_done_callback(lambda _: self.calls.pop(key, None))
+
+        # Shielded so one caller giving up does not cancel the call for the others
+        return await asyncio.shield(task)
+
+
+URL_RE = re.compile(r'^(?:[a-z][a-z0-9+.-]*://|[^\s/]+\.[^\s/]+/)', re.IGNORECASE)
+
+
+def is_search_query(query):
+    # Anything that does not look like a URL is handed to the default search by yt-dlp
+    return not URL_RE.match(query.strip())
+
+
+stream_cache = LRUCache(STREAM_CACHE_SIZE)
+search_cache = LRUCache(SEARCH_CACHE_SIZE)
+search_flight = SingleFlight()
+
+
+def iter_flat_entries(query):
+    # Runs in a worker thread. process=False keeps playlist pages lazy, so entries are
+    # yielded as the extractor pages through them instead of after the whole listing
+    ytdl_flat = worker_ytdl(flat=True)
+    data = ytdl_flat.extract_info(query, download=False, process=False)
+
+    # Follow redirects (default search, short links) until we reach a video or a playlist
+    while data.get('_type') in ('url', 'url_transparent'):
+        data = ytdl_flat.extract_info(data['url'], download=False, process=False, ie_key=data.get('ie_key'))
+
+    if 'entries' in data:
+        for entry in data['entries']:
+            if entry:
+                yield entry
+    else:
+        # A single video was already extracted in full to get here, finish it instead of
+        # extracting it again at play time. The caller caches the stream URL
+        yield stream_data(worker_ytdl().process_ie_result(data, download=False))
+
+
+class ExtractionCancelled(Exception):
+    pass
+
+
+class ExtractionEngine:
+    # Runs yt-dlp work on a bounded pool instead of the loop's default executor.
+    # Single-track and search extractions share EXTRACT_WORKERS slots, granted by priority
+    # and capped per guild. Flat playlist listings are streamed in chunks from their own threads.
+    def __init__(self, pool, workers, guild_limit, playlist_workers):
+        if pool == 'process':
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ytdl')
+        self.playlist_executor = ThreadPoolExecutor(max_workers=playlist_workers, thread_name_prefix='ytdl-playlist')
+        self.workers = workers
+        self.guild_limit = guild_limit
+        self.active = 0
+        self.active_per_guild = {}  # guild id -> running extractions
+        self.waiting = []  # heap of (priority, sequence, guild id, future)
+        self.sequence = itertools.count()
+        self.playlist_locks = {}  # guild id -> lock, a guild's playlists are queued one after another
+        self.streams = {}  # guild id -> stop events of running playlist listings
+
+    async def run(self, func, *args, guild_id=None, priority=PRIORITY_SEARCH):
+        await self._acquire(guild_id, priority)
+        try:
+            return await asyncio.get_event_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self._release(guild_id)
+
+    async def stream(self, func, *args, guild_id=None):
+        # Async iterator over the items yielded by the generator function func. Items are
+        # pulled PLAYLIST_CHUNK_SIZE at a time, each chunk a separate job on the playlist
+        # threads, so a long listing takes turns with other guilds' instead of holding a thread
+        loop = asyncio.get_event_loop()
+        items = func(*args)
+        stopped = threading.Event()
+
+        def next_chunk(size):
+            return list(itertools.islice(items, size))
+
+        lock = self.playlist_locks.setdefault(guild_id, asyncio.Lock())
+        async with lock:
+            self.streams.setdefault(guild_id, set()).add(stopped)
+            # The first chunk is a single item so the first track is queued as soon as it is listed
+            pending = loop.run_in_executor(self.playlist_executor, next_chunk, 1)
+            size = 1
+            try:
+                while pending is not None:
+                    chunk = await pending
+                    pending = None
+                    if stopped.is_set():
+                        raise ExtractionCancelled()
+                    if len(chunk) == size:
+                        # List the next chunk while this one is being queued
+                        size = PLAYLIST_CHUNK_SIZE
+                        pending = loop.run_in_executor(self.playlist_executor, next_chunk, size)
+                    for item in chunk:
+                        yield item
+                        if stopped.is_set():
+                            raise ExtractionCancelled()
+            finally:
+                stopped.set()
+                self.streams[guild_id].discard(stopped)
+                if pending is None:
+                    items.close()
+                else:
+                    # The generator can only be closed once its running chunk is done
+                    def close(future):
+                        if not future.cancelled():
+                            future.exception()  # Retrieved, the listing was given up anyway
+                        items.close()
+
+                    pending.add_done_callback(close)
+
+    def cancel_guild(self, guild_id):
+        # Drop the guild's queued extractions and stop its playlist listings.
+        # Extractions already running finish, their results still fill the caches
+        for _, _, waiting_guild_id, future in self.waiting:
+            if waiting_guild_id == guild_id and not future.done():
+                future.set_exception(ExtractionCancelled())
+        for stopped in self.streams.get(guild_id, ()):
+            stopped.set()
+
+    async def _acquire(self, guild_id, priority):
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self.waiting, (priority, next(self.sequence), guild_id, future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self._release(guild_id)  # The slot was granted just before we were cancelled
+            raise
+
+    def _release(self, guild_id):
+        self.active -= 1
+        self.active_per_guild[guild_id] -= 1
+        if not self.active_per_guild[guild_id]:
+            del self.active_per_guild[guild_id]
+        self._dispatch()
+
+    def _dispatch(self):
+        # Grant free slots to the highest priority waiters whose guild is under its cap
+        blocked = []
+        while self.waiting and self.active < self.workers:
+            item = heapq.heappop(self.waiting)
+            _, _, guild_id, future = item
+            if future.done():
+                continue  # Cancelled while waiting
+            if guild_id is not None and self.active_per_guild.get(guild_id, 0) >= self.guild_limit:
+                blocked.append(item)
+                continue
+            self.active += 1
+            self.active_per_guild[guild_id] = self.active_per_guild.get(guild_id, 0) + 1
+            future.set_result(None)
+        for item in blocked:
+            heapq.heappush(self.waiting, item)
+
+
+extraction = ExtractionEngine(EXTRACT_POOL, EXTRACT_WORKERS, EXTRACT_GUILD_LIMIT, PLAYLIST_WORKERS)
+
+
+class AudioCache:
+    # On-disk cache of frequently played tracks, bounded in bytes with LRU eviction
+    def __init__(self, directory, min_plays, max_bytes):
+        self.directory = directory
+        self.min_plays = min_plays
+        self.max_bytes = max_bytes
+        self.files = OrderedDict()  # video id -> (path, size, title), least recently played first
+        self.total_bytes = 0
+        self.play_counts = OrderedDict()  # video id -> plays, bounded like the files
+        self.downloading = set()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='audio-cache')
+        if directory:
+            self._load()
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def _load(self):
+        # Pick up files from a previous run, oldest access first
+        os.makedirs(self.directory, exist_ok=True)
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith('.opus')]
+        for path in sorted(paths, key=lambda path: os.stat(path).st_atime):
+            video_id = os.path.basename(path)[:-len('.opus')]
+            self._add(video_id, path, None)
+        logger.info(f"Audio cache loaded {len(self.files)} files ({self.total_bytes // 2 ** 20} MB)")
+
+    def local_data(self, video_id):
+        # Track data pointing at the cached file, or None if the track is not on disk
+        entry = self.files.get(video_id)
+        if entry is None:
+            return None
+        path, _, title = entry
+        if not os.path.exists(path):
+            self._remove(video_id)
+            return None
+
+        self.files.move_to_end(video_id)
+        return {
+            'id': video_id,
+            'title': title or video_id,
+            'url': path,
+            'webpage_url': f'https://www.youtube.com/watch?v={video_id}',
+            'acodec': 'opus',
+            'local_file': True,
+        }
+
+    def record_play(self, data):
+        # Count a play and start downloading the track once it is played often enough
+        video_id = data.get('id')
+        if not self.enabled or not video_id or data.get('local_file'):
+            return
+
+        plays = self.play_counts.pop(video_id, 0) + 1
+        self.play_counts[video_id] = plays
+        while len(self.play_counts) > 10000:
+            self.play_counts.popitem(last=False)
+
+        if plays >= self.min_plays and video_id not in self.files and video_id not in self.downloading:
+            self.downloading.add(video_id)
+            asyncio.create_task(self._download(video_id, data.get('webpage_url')))
+
+    async def _download(self, video_id, url):
+        try:
+            path, title = await asyncio.get_event_loop().run_in_executor(
+                self.executor, download_track, url, self.directory)
+            self._add(video_id, path, title)
+            self._evict()
+            logger.info(f"Audio cache stored {title} ({self.total_bytes // 2 ** 20} MB used)")
+        except Exception as e:
+            logger.info(f"Audio cache download failed for {url}: {e}")
+        finally:
+            self.downloading.discard(video_id)
+
+    def _add(self, video_id, path, title):
+        self._remove(video_id)
+        size = os.path.getsize(path)
+        self.files[video_id] = (path, size, title)
+        self.total_bytes += size
+
+    def _remove(self, video_id):
+        entry = self.files.pop(video_id, None)
+        if entry:
+            self.total_bytes -= entry[1]
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and len(self.files) > 1:
+            video_id, (path, _, _) = next(iter(self.files.items()))
+            self._remove(video_id)
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.info(f"Audio cache could not remove {path}: {e}")
+
+
+audio_cache = AudioCache(AUDIO_CACHE_DIR, AUDIO_CACHE_MIN_PLAYS, AUDIO_CACHE_MAX_MB * 2 ** 20)
+
+
+class StateStore:
+    # Write-behind SQLite store for guild sessions. Commands only mark a guild dirty; every
+    # STATE_FLUSH_INTERVAL seconds the dirty and playing guilds are snapshotted and written
+    # in one transaction on the store's own thread, never on the event loop
+    def __init__(self, path):
+        self.path = path
+        self.dirty = set()
+        self.pending = {}  # guild id -> saved row, restored when the guild is first used
+        self.resume_points = {}  # guild id -> (voice channel id, position) to resume playback at
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='state-store')
+        self.connection = None  # Only used from the store thread
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    async def open(self):
+        if not self.enabled:
+            return
+        rows = await asyncio.get_event_loop().run_in_executor(self.executor, self._open)
+        for guild_id, channel_id, volume, position, current, queue in rows:
+            self.pending[guild_id] = (volume, current, queue)
+            if channel_id and current:
+                self.resume_points[guild_id] = (channel_id, position)
+        logger.info(f"Loaded {len(rows)} saved sessions")
+
+    def _open(self):
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (guild_id INTEGER PRIMARY KEY, channel_id INTEGER, "
+            "volume REAL, position REAL, current TEXT, queue TEXT)")
+        self.connection.commit()
+        return self.connection.execute(
+            "SELECT guild_id, channel_id, volume, position, current, queue FROM sessions").fetchall()
+
+    def restore(self, session):
+        # Fill a new session with what was saved for its guild before the restart
+        row = self.pending.pop(session.guild_id, None)
+        if row is None:
+            return
+        volume, current, queue = row
+        session.volume = volume
+        session.queue = TrackQueue(Track(*track) for track in json.loads(queue))
+        if current:
+            session.current = Track(*json.loads(current))
+
+    def mark(self, guild_id):
+        self.dirty.add(guild_id)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(STATE_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.info(f"Saving sessions failed: {e}")
+
+    async def flush(self):
+        if not self.enabled or self.connection is None:
+            return
+
+        dirty = self.dirty
+        self.dirty = set()
+
+        rows = []
+        deletes = []
+        positions = []
+        for guild_id in dirty:
+            session = bot.sessions.get(guild_id)
+            if session is None:
+                continue  # Not restored yet, its saved row is still current
+            guild = bot.get_guild(guild_id)
+            voice_client = guild.voice_client if guild else None
+            playing = voice_client is not None and (voice_client.is_playing() or voice_client.is_paused())
+            if not session.queue and not playing:
+                deletes.append((guild_id,))
+                continue
+
+            # Only plain tuples are built here, JSON encoding happens on the store thread
+            current = None
+            position = 0
+            if playing and session.current is not None:
+                current = self._pack(session.current)
+                position = getattr(voice_client.source, 'position', 0)
+            channel_id = voice_client.channel.id if voice_client and voice_client.channel else None
+            queue = [self._pack(track) for track in session.queue]
+            rows.append((guild_id, channel_id, session.volume, position, current, queue))
+
+        # Guilds that only kept playing just need their position moved on, not their queue rewritten
+        for voice_client in bot.voice_clients:
+            guild_id = voice_client.guild.id
+            if guild_id not in dirty and guild_id in bot.sessions and voice_client.is_playing():
+                positions.append((getattr(voice_client.source, 'position', 0), guild_id))
+
+        if rows or deletes or positions:
+            await asyncio.get_event_loop().run_in_executor(self.executor, self._write, rows, deletes, positions)
+
+    @staticmethod
+    def _pack(track):
+        return track.title, track.url, track.id, track.duration
+
+    def _write(self, rows, deletes, positions):
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?)",
+            [(guild_id, channel_id, volume, position, json.dumps(current) if current else None, json.dumps(queue))
+             for guild_id, channel_id, volume, position, current, queue in rows])
+        self.connection.executemany("DELETE FROM sessions WHERE guild_id = ?", deletes)
+        self.connection.executemany("UPDATE sessions SET position = ? WHERE guild_id = ?", positions)
+        self.connection.commit()
+
+
+state_store = StateStore(STATE_DB)
+
+
+PCM_SILENCE = b'\x00' * 3840  # One 20 ms frame of 48 kHz 16-bit stereo
+OPUS_SILENCE = b'\xf8\xff\xfe'
+
+
+class BufferedAudio(discord.AudioSource):
+    # Bounded read-ahead between an FFmpeg source and the voice player. A background thread
+    # keeps up to READAHEAD_SECONDS of frames queued; when the queue runs dry mid-stream the
+    # player gets a silent frame instead of the end of the track.
+    total_underruns = 0  # Across all buffers, for monitoring
+    active = weakref.WeakSet()  # Open buffers, for the fill level gauge
+
+    def __init__(self, source, seconds):
+        self.original = source
+        self.capacity = max(1, int(seconds * 50))  # 50 frames per second
+        self.frames = deque()
+        self.condition = threading.Condition()
+        self.finished = False  # The source is exhausted
+        self.closed = False
+        self.started = False  # At least one frame was played, startup latency is not an underrun
+        self.underruns = 0
+        self.silence_frames = 0
+        self.silence = OPUS_SILENCE if source.is_opus() else PCM_SILENCE
+        self.thread = threading.Thread(target=self._fill, name='audio-readahead', daemon=True)
+        self.thread.start()
+        BufferedAudio.active.add(self)
+
+    @property
+    def fill_level(self):
+        return len(self.frames) / self.capacity
+
+    def _fill(self):
+        try:
+            while True:
+                with self.condition:
+                    while len(self.frames) >= self.capacity and not self.closed:
+                        self.condition.wait()
+                    if self.closed:
+                        return
+
+                data = self.original.read()  # Blocking pipe read, outside the lock
+
+                with self.condition:
+                    if not data:
+                        return
+                    self.frames.append(data)
+                    self.condition.notify_all()
+        except Exception as e:
+            logger.info(f"Read-ahead reader stopped: {e}")
+        finally:
+            with self.condition:
+                self.finished = True
+                self.condition.notify_all()
+
+    def read(self):
+        with self.condition:
+            if not self.frames and not self.finished:
+                # Give the reader one frame's time before falling back to silence
+                self.condition.wait_for(lambda: self.frames or self.finished, timeout=0.02)
+
+            if self.frames:
+                self.started = True
+                data = self.frames.popleft()
+                self.condition.notify_all()
+                return data
+
+            if self.finished:
+                return b''
+
+            if self.started:
+                self.underruns += 1
+                BufferedAudio.total_underruns += 1
+            self.silence_frames += 1
+            return self.silence
+
+    def is_opus(self):
+        return self.original.is_opus()
+
+    def cleanup(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        BufferedAudio.active.discard(self)
+        if self.underruns:
+            logger.info(f"Read-ahead buffer closed after {self.underruns} underruns")
+        self.original.cleanup()  # Kills FFmpeg, which also unblocks a pending read
+
+
+def read_ahead(source):
+    if READAHEAD_SECONDS > 0:
+        return BufferedAudio(source, READAHEAD_SECONDS)
+    return source
+
+
+def played_seconds(source, frames):
+    # Frames of silence inserted on underruns are not part of the track
+    return (frames - getattr(source, 'silence_frames', 0)) * 0.02
+
+
+def build_ffmpeg_options(start=0, volume=None, local=False):
+    # FFmpeg options for a stream starting at start seconds, optionally with a volume filter.
+    # Reconnect flags only apply to HTTP inputs, FFmpeg rejects them for local files
+    before_options = '' if local else ffmpeg_options['before_options']
+    if start:
+        before_options += f' -ss {start:.2f}'
+    options = ffmpeg_options['options']
+    if volume is not None:
+        options += f' -filter:a volume={volume}'
+    return {'before_options': before_options, 'options': options}
 
 
 class YTDLSource(discord.PCMVolumeTransformer):
-    def __init__(self, source, *, data, volume=0.5):
+    def __init__(self, source, *, data, volume=0.5, start=0):
         super().__init__(source, volume)
         self.data = data
         self.title = data.get('title')
         self.url = data.get('url')
+        self.webpage_url = data.get('webpage_url', self.url)
         self.genre = data.get('genre', 'Unknown Genre')
+        self.start = start  # Position in seconds the stream was opened at
+        self.frames = 0  # 20 ms frames handed to the voice client so far
+
+    @property
+    def position(self):
+        return self.start + played_seconds(self.original, self.frames)
+
+    def read(self):
+        data = super().read()
+        if data:
+            self.frames += 1
+        return data
+
+    @classmethod
+    async def iter_tracks(cls, query, *, loop=None, guild_id=None):
+        # Keyword searches go through the search cache, single videos through the stream cache
+        # and other URLs are streamed from the extractor
+        if is_search_query(query):
+            for track in await cls.search_tracks(query, loop=loop, guild_id=guild_id):
+                yield track
+            return
+
+        # A single video is resolved like any track about to play: on the extraction pool at
+        # play priority, and cached for when it starts
+        if is_single_video_url(query):
+            data = await cls.resolve(query, loop=loop, guild_id=guild_id)
+            yield Track.from_entry(data)
+            return
+
+        # Flat extraction streamed entry by entry: no stream URLs and no FFmpeg processes,
+        # so the first track can be queued while the rest of the playlist is still being listed
+        async for entry in extraction.stream(iter_flat_entries, query, guild_id=guild_id):
+            if entry.get('_type') == 'video':
+                remember_stream(cache_key(entry['webpage_url'] or entry['url']), entry)
+            yield Track.from_entry(entry)
 
     @classmethod
-    async def from_url(cls, url, *, loop=None, volume=0.5):
-        loop = loop or asyncio.get_event_loop()
-        data = await loop.run_in_executor(None, lambda: ytdl.extract_info(url, download=False))
+    async def search_tracks(cls, query, *, loop=None, guild_id=None):
+        # Identical searches from any guild share one cached result and one in-flight extraction.
+        # The shared extraction belongs to no guild, so one guild's /stop cannot fail it for the others
+        key = ' '.join(query.lower().split())
+        tracks = search_cache.get(key)
+        if tracks is None:
+            async def search():
+                started = time.monotonic()
+                entries = await extraction.run(extract_flat_entries, query, priority=PRIORITY_SEARCH)
+                extraction_seconds.observe(time.monotonic() - started)
+                results = [Track.from_entry(entry) for entry in entries]
+                search_cache.put(key, results, time.time() + SEARCH_CACHE_TTL)
+                logger.info(f"Search cache miss for '{key}' ({search_cache.stats()})")
+                return results
+
+            tracks = await search_flight.do(key, search)
+
+        # Hand out copies: queue entries are compared by identity and must not be shared
+        return [track.copy() for track in tracks]
 
-        if 'entries' in data:
-            # This is a playlist, return a list of YTDLSource instances for each entry
-            return [cls(discord.FFmpegPCMAudio(entry['url'], **ffmpeg_options), data=entry, volume=volume) for entry in
-                    data['entries']]
+    @classmethod
+    async def extract_tracks(cls, query, *, loop=None, guild_id=None):
+        # Collect every track record for the query
+        return [track async for track in cls.iter_tracks(query, loop=loop, guild_id=guild_id)]
 
-        # This is a single song
-        filename = data['url']
-        return cls(discord.FFmpegPCMAudio(filename, **ffmpeg_options), data=data, volume=volume)
+    @classmethod
+    async def resolve(cls, url, *, loop=None, guild_id=None, priority=PRIORITY_PLAY):
+        # Fully extract a single track, including its stream URL. Tracks on disk and cached
+        # results whose stream URL is still valid skip yt-dlp entirely
+        key = cache_key(url)
+        data = audio_cache.local_data(key)
+        if data is not None:
+            return data
+
+        data = stream_cache.get(key)
+        if data is not None:
+            return data
+
+        started = time.monotonic()
+        data = await extraction.run(extract_track, url, guild_id=guild_id, priority=priority)
+        extraction_seconds.observe(time.monotonic() - started)
+
+        remember_stream(key, data)
+        logger.info(f"Stream cache miss for {key} ({stream_cache.stats()})")
+        return data
+
+    @classmethod
+    async def from_data(cls, data, *, volume=0.5, start=0):
+        # Start the FFmpeg stream for already resolved track data
+        if AUDIO_MODE == 'opus':
+            return await YTDLOpusSource.from_data(data, volume=volume, start=start)
+        options = build_ffmpeg_options(start, local=data.get('local_file', False))
+        source = discord.FFmpegPCMAudio(data['url'], **options)
+        ffmpeg_sources.add(source)
+        source = read_ahead(source)
+        return cls(source, data=data, volume=volume, start=start)
+
+    @classmethod
+    async def from_url(cls, url, *, loop=None, volume=0.5, guild_id=None):
+        # Fully resolve a single track and start its FFmpeg stream
+        started = time.monotonic()
+        data = await cls.resolve(url, loop=loop, guild_id=guild_id)
+        source = await cls.from_data(data, volume=volume)
+        from_url_seconds.observe(time.monotonic() - started)
+        return source
+
+
+class YTDLOpusSource(discord.AudioSource):
+    # Opus mode: FFmpeg applies the volume and produces Opus itself, or copies YouTube's Opus
+    # stream untouched at full volume, so the bot only forwards packets. The volume is fixed
+    # for the lifetime of the pipe, changing it means reopening the stream at the current position.
+    def __init__(self, source, *, data, volume=0.5, start=0):
+        self.original = source
+        self.data = data
+        self.title = data.get('title')
+        self.url = data.get('url')
+        self.webpage_url = data.get('webpage_url', self.url)
+        self.genre = data.get('genre', 'Unknown Genre')
+        self.volume = volume
+        self.start = start
+        self.frames = 0
+
+    @property
+    def position(self):
+        return self.start + played_seconds(self.original, self.frames)
+
+    @classmethod
+    async def from_data(cls, data, *, volume=0.5, start=0):
+        codec = data.get('acodec')
+        if volume == 1 and codec in (None, 'none'):
+            # Unknown codec: only worth probing when a passthrough copy is possible at all
+            codec, _ = await discord.FFmpegOpusAudio.probe(data['url'], executable=FFMPEG_PATH)
+
+        local = data.get('local_file', False)
+        if volume == 1:
+            # 'opus' makes discord.py copy the stream, anything else is re-encoded by FFmpeg
+            options = build_ffmpeg_options(start, local=local)
+        else:
+            codec = None
+            options = build_ffmpeg_options(start, volume=volume, local=local)
+
+        source = discord.FFmpegOpusAudio(data['url'], codec=codec, executable=FFMPEG_PATH, **options)
+        ffmpeg_sources.add(source)
+        source = read_ahead(source)
+        return cls(source, data=data, volume=volume, start=start)
+
+    def read(self):
+        packet = self.original.read()
+        if packet:
+            self.frames += 1
+        return packet
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        self.original.cleanup()
+
+
+class Prefetcher:
+    # Resolves the head of each guild's queue while the current track is still playing,
+    # so play_next_song can start the next track without waiting for yt-dlp
+    def __init__(self, start_ffmpeg=False):
+        self.start_ffmpeg = start_ffmpeg  # Also open the FFmpeg pipe ahead of time
+        self.pending = {}  # guild id -> (track, task)
+
+    def schedule(self, guild):
+        queue = bot.get_session(guild.id).queue
+        if not queue:
+            self.discard(guild.id)
+            return
+
+        track = queue[0]
+        pending = self.pending.get(guild.id)
+        if pending and pending[0] is track:
+            return  # The head is already being prefetched
+
+        # The head changed (skip, stop, queue edit), drop whatever was prefetched for the old one
+        self.discard(guild.id)
+        self.pending[guild.id] = (track, asyncio.create_task(self._prefetch(guild.id, track)))
+
+    async def _prefetch(self, guild_id, track):
+        data = await YTDLSource.resolve(track.url, loop=bot.loop, guild_id=guild_id, priority=PRIORITY_PREFETCH)
+        logger.info(f"Prefetched next song: {track.title}")
+        if self.start_ffmpeg:
+            return await YTDLSource.from_data(data, volume=bot.get_session(guild_id).volume)
+        return data
+
+    async def take(self, guild_id, track):
+        # Return a ready source for track, or None if it was not prefetched
+        pending = self.pending.pop(guild_id, None)
+        if pending is None:
+            return None
+
+        prefetched_track, task = pending
+        if prefetched_track is not track:
+            self._cleanup(task)
+            return None
+
+        try:
+            result = await task
+        except Exception as e:
+            logger.info(f"Prefetch failed, resolving again: {e}")
+            return None
+
+        volume = bot.get_session(guild_id).volume
+        if isinstance(result, YTDLSource):
+            result.volume = volume  # The volume may have changed since the pipe was opened
+            return result
+        if isinstance(result, YTDLOpusSource):
+            if result.volume == volume:
+                return result
+            # The volume is baked into the Opus pipe, reopen it
+            result.cleanup()
+            result = result.data
+        return await YTDLSource.from_data(result, volume=volume)
+
+    def discard(self, guild_id):
+        pending = self.pending.pop(guild_id, None)
+        if pending:
+            self._cleanup(pending[1])
+
+    @staticmethod
+    def _cleanup(task):
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled() and task.exception() is None and isinstance(task.result(), discord.AudioSource):
+            task.result().cleanup()  # Kill the FFmpeg process that was opened ahead of time
+
+
+prefetcher = Prefetcher(start_ffmpeg=os.getenv('PREFETCH_FFMPEG', '0') == '1')
+
+
+class ChannelOutbox:
+    __slots__ = ('messages', 'now_playing', 'last_now_playing', 'next_send_at', 'task')
+
+    def __init__(self):
+        self.messages = deque()  # Plain messages, sent in order
+        self.now_playing = None  # Latest now-playing text not sent yet
+        self.last_now_playing = None  # Message showing the now-playing text, edited while it is the latest
+        self.next_send_at = 0  # Loop time before which the channel gets nothing new
+        self.task = None
+
+
+class Notifier:
+    # Messages are queued per channel and sent at most every NOTIFY_INTERVAL. A now-playing update
+    # replaces one still waiting, and edits the previous now-playing message while nothing was
+    # posted after it, so fast skips cost one request. The presence is a summary of all guilds
+    # refreshed every PRESENCE_INTERVAL instead of a gateway update per track change.
+    def __init__(self):
+        self.outboxes = {}  # channel id -> ChannelOutbox
+        self.presence = None  # Activity name last sent
+
+    def send(self, channel, content):
+        outbox = self._outbox(channel)
+        outbox.messages.append(content)
+        self._wake(channel, outbox)
+
+    def now_playing(self, channel, content):
+        outbox = self._outbox(channel)
+        outbox.now_playing = content
+        self._wake(channel, outbox)
+
+    def _outbox(self, channel):
+        outbox = self.outboxes.get(channel.id)
+        if outbox is None:
+            outbox = self.outboxes[channel.id] = ChannelOutbox()
+        return outbox
+
+    def _wake(self, channel, outbox):
+        if outbox.task is None or outbox.task.done():
+            outbox.task = asyncio.get_event_loop().create_task(self._drain(channel, outbox))
+
+    async def _drain(self, channel, outbox):
+        loop = asyncio.get_event_loop()
+        while outbox.messages or outbox.now_playing is not None:
+            delay = outbox.next_send_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)  # Now-playing updates arriving meanwhile are coalesced
+
+            delay = NOTIFY_INTERVAL
+            try:
+                if outbox.messages:
+                    await channel.send(outbox.messages.popleft())
+                else:
+                    content, outbox.now_playing = outbox.now_playing, None
+                    message = outbox.last_now_playing
+                    if message is not None and channel.last_message_id == message.id:
+                        await message.edit(content=content)
+                    else:
+                        outbox.last_now_playing = await channel.send(content)
+            except discord.HTTPException as e:
+                logger.info(f"Sending to #{channel} failed: {e}")
+                if e.status == 429:
+                    delay = max(delay, 4 * NOTIFY_INTERVAL)  # Rate limited, give the channel more room
+            outbox.next_send_at = loop.time() + delay
+
+    async def run_presence(self):
+        while True:
+            await asyncio.sleep(PRESENCE_INTERVAL)
+            try:
+                await self.update_presence()
+            except Exception as e:
+                logger.info(f"Updating the presence failed: {e}")
+
+    async def update_presence(self, force=False):
+        playing = [voice_client.guild.id for voice_client in bot.voice_clients if voice_client.is_playing()]
+        if not playing:
+            name = IDLE_PRESENCE
+        elif len(playing) == 1:
+            session = bot.get_session(playing[0])
+            # The title of a 'Guess the Song' track would give the answer away
+            name = "Guess the Song" if session.game_active or session.current is None else session.current.title
+        else:
+            name = f"music in {len(playing)} servers"
+
+        if force or name != self.presence:
+            await bot.change_presence(status=discord.Status.online, activity=discord.Game(name=name))
+            self.presence = name
+
+
+notifier = Notifier()
 
 # Event when the bot has connected to Discord
 @bot.event
 async def on_ready():
-    # Reset song queue, volume, and disconnect timers for all guilds
-    bot.song_queue = {}  # Reset the song queue for all guilds
-    bot.current_volume = {}  # Reset the volume settings for all guilds
-    bot.disconnect_timer = {}  # Reset the disconnect timers for all guilds
-
-    # Set the bot's status to "Doing nothing"
-    await bot.change_presence(status=discord.Status.online,
-                              activity=discord.Game(name="Doing nothing. Use /play to use me."))
+    # Set the bot's status, "Doing nothing" until music plays
+    await notifier.update_presence(force=True)
 
     logger.info(f'Logged in as {bot.user}')
 
+    # on_ready fires again after a gateway reconnect, the sessions in memory are still valid then
+    if bot.restored:
+        return
+    bot.restored = True
+    startup_phase('ready')
+    bot.loop.create_task(notifier.run_presence())
+
     # Optionally notify in the 'dj-remix' channel of each guild that the bot has restarted
     for guild in bot.guilds:
         # If the bot is in a voice channel, disconnect
@@ -123,12 +1534,41 @@ async def on_ready():
         # Send a restart notification in the 'dj-remix' channel
         dj_channel = await get_channel(guild)
         if dj_channel:
-            await dj_channel.send("I am back and ready!")
+            notifier.send(dj_channel, "I am back and ready!")
+
+    # Resume saved playback one guild at a time
+    bot.loop.create_task(resume_saved_sessions())
+
+
+async def resume_saved_sessions():
+    for guild_id, (channel_id, position) in list(state_store.resume_points.items()):
+        await asyncio.sleep(RESTORE_INTERVAL)
+        guild = bot.get_guild(guild_id)
+        channel = guild.get_channel(channel_id) if guild else None
+        if channel is None or guild.voice_client is not None:
+            continue  # Gone, or a command already took over
+        if not any(not member.bot for member in channel.members):
+            continue  # Nobody to play to, the queue is still restored when the guild uses the bot
+
+        session = bot.get_session(guild_id)
+        if session.current is None:
+            continue
+        try:
+            await channel.connect()
+            data = await YTDLSource.resolve(session.current.url, loop=bot.loop, guild_id=guild_id)
+            player = await YTDLSource.from_data(data, volume=session.volume, start=position)
+            guild.voice_client.play(player, after=lambda e, guild=guild: asyncio.run_coroutine_threadsafe(play_next_song(guild), bot.loop))
+            prefetcher.schedule(guild)
+            logger.info(f"Resumed {session.current.title} at {position:.0f} s in {guild.name}")
+        except Exception as e:
+            logger.info(f"Could not resume playback in {guild.name}: {e}")
+    state_store.resume_points.clear()
 
 
 # Slash command to play music from YouTube by URL or keyword
 @bot.tree.command(name="play", description="Plays a song or playlist from YouTube")
 async def play(interaction: discord.Interaction, query: str):
+    started = time.monotonic()
     if not await check_channel(interaction):
         return
 
@@ -149,58 +1589,75 @@ async def play(interaction: discord.Interaction, query: str):
         voice_client = interaction.guild.voice_client
 
     async with interaction.channel.typing():
-        try:
-            sources = await YTDLSource.from_url(query, loop=bot.loop,
-                                                volume=bot.current_volume.get(interaction.guild.id, 0.05))
-            is_playlist = isinstance(sources, list)
-
-            # Initialize queue if not present
-            if interaction.guild.id not in bot.song_queue:
-                bot.song_queue[interaction.guild.id] = []
-
-            added_count = 0
+        added_count = 0
+        status_message = None
+        last_update = 0
 
-            if is_playlist:
-                for player in sources:
-                    if player.url not in [song['url'] for song in bot.song_queue[interaction.guild.id]]:
-                        bot.song_queue[interaction.guild.id].append({'title': player.title, 'url': player.url})
-                        added_count += 1
-
-                if added_count > 0:
-                    await interaction.followup.send(f'Added {added_count} songs to the queue.')
-
-                if not voice_client.is_playing() and bot.song_queue[interaction.guild.id]:
+        try:
+            # Tracks are queued as the extractor yields them, playback starts on the first one
+            async for track in YTDLSource.iter_tracks(query, loop=bot.loop, guild_id=interaction.guild.id):
+                # Looked up per track, /guess_the_song may replace the queue mid-ingestion
+                if not bot.get_session(interaction.guild.id).queue.append(track):
+                    continue  # Already queued
+                state_store.mark(interaction.guild.id)
+                added_count += 1
+
+                if not voice_client.is_playing() and not voice_client.is_paused():
                     await play_next_song(interaction.guild)
-
+                    if voice_client.is_playing():
+                        first_audio_seconds.observe(time.monotonic() - started)
+                else:
+                    prefetcher.schedule(interaction.guild)
+
+                # Keep a single followup updated with the running count, throttled to avoid rate limits
+                if status_message is None:
+                    status_message = await interaction.followup.send(
+                        f'Added {added_count} songs to the queue...', wait=True)
+                    last_update = bot.loop.time()
+                elif bot.loop.time() - last_update >= PLAYLIST_STATUS_INTERVAL:
+                    await status_message.edit(content=f'Added {added_count} songs to the queue...')
+                    last_update = bot.loop.time()
+
+            if status_message is None:
+                await interaction.followup.send('No new songs were added to the queue.')
             else:
-                if sources.url not in [song['url'] for song in bot.song_queue[interaction.guild.id]]:
-                    bot.song_queue[interaction.guild.id].append({'title': sources.title, 'url': sources.url})
-                    added_count += 1
-
-                if not voice_client.is_playing():
-                    await play_next_song(interaction.guild)
-
-                elif added_count > 0:
-                    await interaction.followup.send(f'Added {added_count} songs to the queue.')
+                await status_message.edit(content=f'Added {added_count} songs to the queue.')
+        except ExtractionCancelled:
+            await interaction.followup.send(f'Stopped adding songs after {added_count} songs.')
         except Exception as e:
             await interaction.followup.send(f"An error occurred: {e}")
 
 @bot.event
 async def on_voice_state_update(member, before, after):
-    logger.debug('Started on voice state update')
-    global disconnected
-    if disconnected:
-        logger.debug('on voice state update aborted because disconnected is true')
-        return
+    # Runs for every voice change of every member, so bail out early unless the change
+    # moves someone into or out of the bot's channel
+    if before.channel == after.channel:
+        return  # Mute, deafen, stream or video toggles
 
     guild = member.guild
-    voice_client = guild.voice_client
+    if member.id == bot.user.id:
+        bot.get_session(guild.id).listeners = None  # The bot itself moved, recount below
 
-    if voice_client is None:
+    voice_client = guild.voice_client
+    if voice_client is None or voice_client.channel is None:
         return  # If bot is not in a voice channel, do nothing
 
-    await check_voice_channel(guild)
-    logger.debug('on voice state update finished')
+    channel = voice_client.channel
+    if before.channel != channel and after.channel != channel:
+        return
+    if member.bot and member.id != bot.user.id:
+        return
+
+    session = bot.get_session(guild.id)
+    if session.listeners is None:
+        session.listeners = sum(1 for listener in channel.members if not listener.bot)
+    elif after.channel == channel:
+        session.listeners += 1
+    else:
+        session.listeners -= 1
+    logger.debug(f'{session.listeners} listeners in the voice channel')
+
+    await update_listening(guild, voice_client, session)
 
 
 # Slash command to skip the current song
@@ -232,7 +1689,10 @@ async def stop(interaction: discord.Interaction):
         return
 
     # Clear the queue and stop the current song
-    bot.song_queue[interaction.guild.id] = []  # Clear the song queue
+    bot.get_session(interaction.guild.id).queue.clear()  # Clear the song queue
+    state_store.mark(interaction.guild.id)
+    prefetcher.discard(interaction.guild.id)
+    extraction.cancel_guild(interaction.guild.id)
     if voice_client.is_playing() or voice_client.is_paused():
         voice_client.stop()  # Stop any song, whether playing or paused
 
@@ -242,48 +1702,144 @@ async def stop(interaction: discord.Interaction):
     await interaction.response.send_message("Stopped the music and cleared the queue.")
 
 
+def format_duration(seconds):
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return f"{hours}:{minutes:02}:{seconds:02}"
+    return f"{minutes}:{seconds:02}"
+
+
+class QueueView(discord.ui.View):
+    # One /queue message with buttons to page through it. Pages are rendered from their
+    # own slice of the queue, so the cost does not depend on the queue length
+    def __init__(self, session, author_id):
+        super().__init__(timeout=QUEUE_VIEW_TIMEOUT)
+        self.session = session
+        self.author_id = author_id
+        self.page = 0
+
+    @property
+    def page_count(self):
+        return max(1, -(-len(self.session.queue) // QUEUE_PAGE_SIZE))
+
+    def render(self):
+        queue = self.session.queue
+        self.page = min(self.page, self.page_count - 1)
+        start = self.page * QUEUE_PAGE_SIZE
+
+        lines = []
+        for position, track in enumerate(queue.page(start, start + QUEUE_PAGE_SIZE), start=start + 1):
+            duration = f" ({format_duration(track.duration)})" if track.duration else ""
+            lines.append(f"{position}. {track.title}{duration}")
+
+        embed = discord.Embed(title="Queue", description="\n".join(lines) or "The queue is currently empty.")
+        # The title is the answer during 'Guess the Song'
+        if self.session.current is not None and not self.session.game_active:
+            embed.add_field(name="Now playing", value=self.session.current.title, inline=False)
+
+        total = format_duration(queue.total_duration)
+        if queue.unknown_durations:
+            total += "+"
+        embed.set_footer(text=f"Page {self.page + 1}/{self.page_count} · {len(queue)} songs · {total}")
+
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= self.page_count - 1
+        return embed
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        # Only the member who asked for the queue can page through it
+        return interaction.user.id == self.author_id
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page -= 1
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page += 1
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+
 # Slash command to view the song queue
 @bot.tree.command(name="queue", description="Shows the current playlist")
 async def queue(interaction: discord.Interaction):
-    # Defer the response to indicate processing time
-    await interaction.response.defer()
+    session = bot.get_session(interaction.guild.id)
 
-    queue = bot.song_queue.get(interaction.guild.id, [])
+    if not session.queue:
+        await interaction.response.send_message("The queue is currently empty.")
+        return
 
-    if not queue:
-        await interaction.followup.send("The queue is currently empty.")
+    view = QueueView(session, interaction.user.id)
+    await interaction.response.send_message(embed=view.render(), view=view)
+
+
+# Slash command to remove a song from the queue
+@bot.tree.command(name="remove", description="Removes a song from the queue by its position")
+async def remove(interaction: discord.Interaction, position: int):
+    if not await check_channel(interaction):
         return
 
-    # Create a list of song titles with their positions
-    queue_list = [f"{i + 1}. {song['title']}" for i, song in enumerate(queue)]
+    queue = bot.get_session(interaction.guild.id).queue
+    if position < 1 or position > len(queue):
+        await interaction.response.send_message(f"Please provide a position between 1 and {len(queue)}.", ephemeral=True)
+        return
 
-    # Split the queue into chunks that fit the 2000-character limit
-    chunk_size = 1700  # Set a lower limit to account for formatting and possible padding
-    chunks = []
-    current_chunk = ""
+    track = queue.remove(position - 1)
+    state_store.mark(interaction.guild.id)
+    prefetcher.schedule(interaction.guild)
+    await interaction.response.send_message(f"Removed **{track.title}** from the queue.")
 
-    for item in queue_list:
-        if len(current_chunk) + len(item) + 2 > chunk_size:  # +2 for "\n"
-            chunks.append(current_chunk)
-            current_chunk = ""
-        current_chunk += f"{item}\n"
 
-    # Append the last chunk if it's not empty
-    if current_chunk:
-        chunks.append(current_chunk)
+# Slash command to move a song within the queue
+@bot.tree.command(name="move", description="Moves a song in the queue to another position")
+async def move(interaction: discord.Interaction, position: int, new_position: int):
+    if not await check_channel(interaction):
+        return
 
-    # Send each chunk as a separate message with error handling
-    for chunk in chunks:
-        try:
-            await interaction.followup.send(chunk)
-            await asyncio.sleep(1)  # Small delay to avoid rate limits
-        except discord.HTTPException as e:
-            logger.info(f"Failed to send message: {e}")
-            break  # Exit on error to avoid excessive failures
+    queue = bot.get_session(interaction.guild.id).queue
+    if not (1 <= position <= len(queue) and 1 <= new_position <= len(queue)):
+        await interaction.response.send_message(f"Please provide positions between 1 and {len(queue)}.", ephemeral=True)
+        return
+
+    track = queue.move(position - 1, new_position - 1)
+    state_store.mark(interaction.guild.id)
+    prefetcher.schedule(interaction.guild)
+    await interaction.response.send_message(f"Moved **{track.title}** to position {new_position}.")
+
+
+# Slash command to shuffle the queue
+@bot.tree.command(name="shuffle", description="Shuffles the songs in the queue")
+async def shuffle(interaction: discord.Interaction):
+    if not await check_channel(interaction):
+        return
+
+    queue = bot.get_session(interaction.guild.id).queue
+    if not queue:
+        await interaction.response.send_message("The queue is currently empty.", ephemeral=True)
+        return
+
+    queue.shuffle()
+    state_store.mark(interaction.guild.id)
+    prefetcher.schedule(interaction.guild)
+    await interaction.response.send_message(f"Shuffled {len(queue)} songs.")
+
+
+# Slash command to clear the queue without stopping the current song
+@bot.tree.command(name="clear", description="Clears the queue but keeps the current song playing")
+async def clear(interaction: discord.Interaction):
+    if not await check_channel(interaction):
+        return
 
-    # After sending all chunks, inform that the queue has been displayed
-    if chunks:
-        await interaction.followup.send("Displayed the full queue.")
+    queue = bot.get_session(interaction.guild.id).queue
+    count = len(queue)
+    queue.clear()
+    state_store.mark(interaction.guild.id)
+    prefetcher.discard(interaction.guild.id)
+    extraction.cancel_guild(interaction.guild.id)  # A playlist still being listed would refill the queue
+    await interaction.response.send_message(f"Cleared {count} songs from the queue.")
 
 
 # Slash command to pause the music
@@ -322,6 +1878,7 @@ async def resume(interaction: discord.Interaction):
         return
 
     voice_client.resume()
+    bot.get_session(interaction.guild.id).paused_alone = False
     await interaction.response.send_message("Resumed the song.")
 
 
@@ -341,8 +1898,23 @@ async def volume(interaction: discord.Interaction, level: int):
         await interaction.response.send_message("There is no song currently playing.", ephemeral=True)
         return
 
-    bot.current_volume[interaction.guild.id] = level / 100  # Store volume as a decimal
-    voice_client.source.volume = bot.current_volume[interaction.guild.id]
+    session = bot.get_session(interaction.guild.id)
+    session.volume = level / 100  # Store volume as a decimal
+    state_store.mark(interaction.guild.id)
+    source = voice_client.source
+    if source.is_opus():
+        # The volume is applied by FFmpeg, reopen the stream where it currently is
+        await interaction.response.defer()
+        try:
+            new_source = await reopen_source(source, interaction.guild.id, start=source.position)
+        except Exception as e:
+            await interaction.followup.send(f"An error occurred while changing the volume: {e}")
+            return
+        swap_source(voice_client, new_source)
+        await interaction.followup.send(f"Set the volume to {level}%.")
+        return
+
+    source.volume = session.volume
     await interaction.response.send_message(f"Set the volume to {level}%.")
 
 # Slash command to seek to a specific time in the current song
@@ -353,30 +1925,184 @@ async def seek(interaction: discord.Interaction, position: str):
 
     voice_client = interaction.guild.voice_client
 
-    if voice_client is None or not voice_client.is_playing():
+    if voice_client is None or not (voice_client.is_playing() or voice_client.is_paused()):
         await interaction.response.send_message("There is no song currently playing.", ephemeral=True)
         return
 
-    # Parse the position input (MM:SS format or seconds)
+    # Where the song is now, counted from the frames already sent
+    source = voice_client.source
     try:
-        if ":" in position:
-            minutes, seconds = map(int, position.split(":"))
-            seek_position = minutes * 60 + seconds
-        else:
-            seek_position = int(position)
+        seek_position = parse_seek_position(position, source.position)
     except ValueError:
-        await interaction.response.send_message("Invalid time format. Please use MM:SS or seconds.", ephemeral=True)
+        await interaction.response.send_message(
+            "Invalid time format. Please use MM:SS, seconds, or +/- seconds to jump.", ephemeral=True)
         return
 
-    next_song_info = currentSong
-    song_url = next_song_info['url']
+    seek_position = max(0, seek_position)
+    duration = source.data.get('duration')
+    if duration and seek_position >= duration:
+        await interaction.response.send_message(
+            f"The song is only {format_duration(duration)} long.", ephemeral=True)
+        return
 
-    # Stop the current playback
-    voice_client.stop()
+    # Open the same stream at the new position and swap it in, the queue does not move
+    await interaction.response.defer()
+    try:
+        new_source = await reopen_source(source, interaction.guild.id, start=seek_position)
+    except Exception as e:
+        await interaction.followup.send(f"An error occurred while seeking: {e}")
+        return
+    # Setting the source resumes the player, a paused song has to stay paused
+    paused = voice_client.is_paused()
+    swap_source(voice_client, new_source)
+    if paused:
+        voice_client.pause()
+    logger.info(f"Seeked to {seek_position:.0f} s")
+    await interaction.followup.send(f"Seeked to {format_duration(seek_position)}.")
+
+
+def parse_seek_position(text, current):
+    # "90", "1:30" or "1:02:03", or relative to the current position with "+30" or "-1:00"
+    text = text.strip()
+    sign = text[:1] if text[:1] in ('+', '-') else ''
+    seconds = 0
+    for part in text[len(sign):].split(':'):
+        if not part.isdigit():
+            raise ValueError(f"Invalid time: {text}")  # int() would also take '-5' or '+5'
+        seconds = seconds * 60 + int(part)
+    if sign == '+':
+        return current + seconds
+    if sign == '-':
+        return current - seconds
+    return seconds
+
+
+# Bracketed notes and words that say nothing about which song it is
+TITLE_NOTE_RE = re.compile(r'[(\[][^)\]]*[)\]]')
+TITLE_SEPARATOR_RE = re.compile(r'\s[-\u2013\u2014|:~]\s')
+TITLE_STOPWORDS = {'a', 'an', 'and', 'the', 'of', 'ft', 'feat', 'featuring', 'official', 'video', 'audio',
+                   'music', 'lyric', 'lyrics', 'hd', 'hq', '4k', 'remastered', 'visualizer', 'mv'}
+RANDOM_GAME_QUERIES = ["top hits 2024", "most popular songs", "underrated tracks", "classic rock hits",
+                       "hip-hop top 10", "EDM random mix", "90s pop hits", "current trending music"]
+
+
+def title_tokens(text):
+    # Lowercase words without accents, punctuation or filler
+    text = unicodedata.normalize('NFKD', TITLE_NOTE_RE.sub(' ', text))
+    text = ''.join(char for char in text if not unicodedata.combining(char)).lower()
+    return tuple(word for word in re.findall(r'\w+', text) if word not in TITLE_STOPWORDS)
+
+
+def similar_token(token, other):
+    if token == other:
+        return True
+    # Short words must match exactly, longer ones may carry a typo
+    if len(token) < 4 or abs(len(token) - len(other)) > 2:
+        return False
+    return difflib.SequenceMatcher(None, token, other).ratio() >= 0.8
+
+
+def match_score(answer, guess):
+    # F1 over tokens: a guess has to name most of the answer without listing half the dictionary
+    if not answer or not guess:
+        return 0.0
+    recalled = sum(1 for token in answer if any(similar_token(token, word) for word in guess))
+    if not recalled:
+        return 0.0
+    precise = sum(1 for word in guess if any(similar_token(token, word) for token in answer))
+    recall = recalled / len(answer)
+    precision = precise / len(guess)
+    return 2 * recall * precision / (recall + precision)
+
+
+class GameTrack:
+    # A track ready for 'Guess the Song', with everything /guess compares against worked out once
+    __slots__ = ('track', 'normalized_title', 'mask', 'initials', 'answers')
+
+    def __init__(self, track):
+        self.track = track
+        tokens = title_tokens(track.title)
+        self.normalized_title = ' '.join(tokens)
+        self.mask = re.sub(r'[^\s]', '_', track.title)
+        self.initials = ' '.join(word[0].upper() for word in track.title.split())
+        # "Artist - Song" titles: naming just the song also counts, naming just the artist does not
+        answers = {tokens}
+        parts = TITLE_SEPARATOR_RE.split(track.title, maxsplit=1)
+        if len(parts) > 1:
+            answers.add(title_tokens(parts[1]))
+        self.answers = tuple(answer for answer in answers if answer)
+
+    def score(self, guess):
+        guess = title_tokens(guess[:200])
+        return max((match_score(answer, guess) for answer in self.answers), default=0.0)
+
+
+class GamePool:
+    # Random search hits resolved at low priority while nobody is waiting, so /guess_the_song
+    # starts from the stream cache. Taking a track wakes the background refill; the pool is
+    # only filled once the first game has been started
+    def __init__(self, size):
+        self.size = size
+        self.entries = deque()  # GameTrack
+        self.recent = deque(maxlen=max(1, size) * 10)  # Keys of recently pooled tracks, avoids repeats
+        self.wanted = None  # Created in run(), on the bot's event loop
+
+    async def run(self):
+        self.wanted = asyncio.Event()
+        await self.wanted.wait()
+        while True:
+            if len(self.entries) >= self.size:
+                self.wanted.clear()
+                await self.wanted.wait()
+                continue
+            try:
+                await self.fill(self.size - len(self.entries))
+            except Exception as e:
+                logger.info(f"Refilling the game pool failed: {e}")
+                await asyncio.sleep(60)
+
+    async def fill(self, count, guild_id=None):
+        # Search one random phrase and resolve up to count new tracks from it. Background refills
+        # belong to no guild; a cold fill for a waiting game counts against that guild
+        query = f"ytsearch{GAME_SEARCH_RESULTS}:{random.choice(RANDOM_GAME_QUERIES)}"
+        entries = await extraction.run(extract_flat_entries, query, guild_id=guild_id, priority=PRIORITY_PREFETCH)
+        random.shuffle(entries)
+        added = 0
+        for entry in entries:
+            if added >= count:
+                break
+            track = Track.from_entry(entry)
+            key = cache_key(track.url)
+            if not track.title or key in self.recent:
+                continue
+            game_track = GameTrack(track)
+            if not game_track.answers:
+                continue  # Nothing but filler like "Official Video", no guess could ever match
+            self.recent.append(key)  # Before resolving, so a concurrent fill does not pick it too
+            try:
+                await YTDLSource.resolve(track.url, guild_id=guild_id, priority=PRIORITY_PREFETCH)
+            except Exception as e:
+                logger.info(f"Skipping game track {track.title}: {e}")
+                continue
+            self.entries.append(game_track)
+            added += 1
+
+    async def take(self, guild_id=None):
+        if self.wanted is not None:
+            self.wanted.set()
+        # Tracks whose stream URL has expired since they were pooled would have to be extracted
+        # again, drop them and let the refill replace them
+        while self.entries:
+            game_track = self.entries.popleft()
+            key = cache_key(game_track.track.url)
+            if key in stream_cache or audio_cache.local_data(key) is not None:
+                return game_track
+        await self.fill(1, guild_id)  # Nothing usable pooled, wait for a single track
+        return self.entries.popleft() if self.entries else None
+
+
+game_pool = GamePool(GAME_POOL_SIZE)
 
-    # Play the song from the seek position
-    await play_song_with_seek(voice_client, song_url, seek_position, interaction.guild)
-    await interaction.response.send_message(f"Seeked to {seek_position} seconds.")
 
 # Slash command to start "Guess the Song" mode
 @bot.tree.command(name="guess_the_song", description="Starts a 'Guess the Song' game with random YouTube songs.")
@@ -401,45 +2127,30 @@ async def guess_the_song(interaction: discord.Interaction):
             return
         voice_client = interaction.guild.voice_client
 
-    # Search for random songs on YouTube
-    random_query = random.choice([
-        "top hits 2024", "most popular songs", "underrated tracks", "classic rock hits",
-        "hip-hop top 10", "EDM random mix", "90s pop hits", "current trending music"
-    ])
     try:
-        # Fetch random song results from YouTube
-        sources = await YTDLSource.from_url(random_query, loop=bot.loop, volume=bot.current_volume.get(interaction.guild.id, 0.05))
-        if isinstance(sources, list):
-            # If it's a playlist, pick one song randomly
-            source = random.choice(sources)
-        else:
-            source = sources
-
-        # Save the current song title for guessing game
-        guessing_game_active[interaction.guild.id] = True
-        song_title_masked[interaction.guild.id] = re.sub(r'[^\s]', '_', source.title)  # Mask the song title
-        guess_attempts[interaction.guild.id] = 0
-
-        # Get the initials of the song title
-        song_initials = ' '.join(word[0].upper() for word in source.title.split())
-
-        # Store genre and song details
-        currentSong[interaction.guild.id] = {
-            'title': source.title,
-            'url': source.url,
-            'genre': source.genre,
-            'initials': song_initials
-        }
+        # Take a random song that was searched and resolved ahead of time
+        game_track = await game_pool.take(interaction.guild.id)
+        if game_track is None:
+            await interaction.followup.send("No songs found for the game, please try again.")
+            return
+
+        # Save the song for this guild's game
+        session = bot.get_session(interaction.guild.id)
+        session.game_active = True
+        session.game_track = game_track
+        session.guess_attempts = 0
+        genre = 'Unknown Genre'  # Flat search results carry no genre
 
         # Add the song to the queue and start playing it
-        bot.song_queue[interaction.guild.id] = [{'title': source.title, 'url': source.url}]
+        session.queue = TrackQueue([game_track.track.copy()])
+        state_store.mark(interaction.guild.id)
         await play_next_song(interaction.guild)
 
         # Announce the game
         await interaction.followup.send(
-            f"🎵 Guess the song! Here's a clue: **{song_title_masked[interaction.guild.id]}**\n"
-            f"Initials: **{song_initials}**\n"
-            f"Genre: **{source.genre}**")
+            f"🎵 Guess the song! Here's a clue: **{game_track.mask}**\n"
+            f"Initials: **{game_track.initials}**\n"
+            f"Genre: **{genre}**")
 
     except Exception as e:
         await interaction.followup.send(f"An error occurred while searching for a random song: {e}")
@@ -447,80 +2158,102 @@ async def guess_the_song(interaction: discord.Interaction):
 # Command for users to guess the song
 @bot.tree.command(name="guess", description="Make a guess for the 'Guess the Song' game.")
 async def guess_song(interaction: discord.Interaction, guess: str):
-    if not guessing_game_active.get(interaction.guild.id, False):
+    session = bot.get_session(interaction.guild.id)
+    game_track = session.game_track
+    if not session.game_active or game_track is None:
         await interaction.response.send_message("There's no active 'Guess the Song' game right now.", ephemeral=True)
         return
 
-    current_song = currentSong.get('title', '').lower()
-    guess = guess.lower()
-
-    guess_attempts[interaction.guild.id] += 1
+    session.guess_attempts += 1
 
-    if guess in current_song:
-        await interaction.response.send_message(f"🎉 Correct! The song was **{currentSong['title']}**.")
-        guessing_game_active[interaction.guild.id] = False  # End the game
+    if game_track.score(guess) >= GUESS_MATCH_THRESHOLD:
+        await interaction.response.send_message(f"🎉 Correct! The song was **{game_track.track.title}**.")
+        session.game_active = False  # End the game
     else:
-        await interaction.response.send_message(f"❌ Incorrect guess. Keep trying! Current clue: **{song_title_masked[interaction.guild.id]}**")
+        await interaction.response.send_message(f"❌ Incorrect guess. Keep trying! Current clue: **{game_track.mask}**")
 
-async def play_song_with_seek(voice_client, song_url, seek_position, guild):
-    # Refetch the URL before seeking to ensure it's fresh and hasn't expired
-    fresh_song_info = await YTDLSource.from_url(song_url, loop=bot.loop,volume=bot.current_volume.get(guild.id, 0.05))
-    fresh_url = fresh_song_info.url
+async def reopen_source(source, guild_id, start=0):
+    # Open the playing track again at start seconds. The source's own stream URL is reused
+    # while it is valid, so this costs an FFmpeg input seek instead of a yt-dlp extraction
+    data = source.data
+    if not data.get('local_file') and stream_expiry(data) <= time.time():
+        data = await YTDLSource.resolve(source.webpage_url, loop=bot.loop, guild_id=guild_id)
+    return await YTDLSource.from_data(data, volume=bot.get_session(guild_id).volume, start=start)
 
-    # Set FFmpeg options with the seek position
-    seek_ffmpeg_options = {
-        'before_options': f'-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5 -ss {seek_position}',
-        'options': '-vn'
-    }
-    logger.info(f"Playing song with seek. {seek_position}")
 
-    # Ensure the FFmpeg source uses the fresh URL and seek options
-    player = discord.FFmpegPCMAudio(
-        fresh_url,
-        **seek_ffmpeg_options,
-        executable="ffmpeg"
-    )
-
-    current_volume = bot.current_volume.get(guild.id, 0.05)  # Get the current volume, default to 50%
-    player_with_volume = discord.PCMVolumeTransformer(player, volume=current_volume)
-
-    # Play the audio with the specified seek position
-    voice_client.play(player_with_volume, after=lambda e: asyncio.run_coroutine_threadsafe(play_next_song(guild), bot.loop))
+def swap_source(voice_client, source):
+    # Replace the playing source without firing the after callback that advances the queue
+    old_source = voice_client.source
+    voice_client.source = source
+    # The player thread may still be inside a read() of the old source, close it a bit later
+    bot.loop.call_later(1, old_source.cleanup)
 
 
 async def play_next_song(guild):
-    global currentSong
+    started = time.monotonic()
+    log_guild_id.set(guild.id)
     voice_client = guild.voice_client
-    if voice_client and not voice_client.is_playing():
-        queue = bot.song_queue.get(guild.id)
-        if queue and len(queue) > 0:
+    session = bot.get_session(guild.id)
+    if not voice_client or voice_client.is_playing():
+        return
+
+    # The after callback and /play both start songs, one of them at a time per guild
+    async with session.play_lock:
+        # Songs that cannot be played (private, deleted, region locked) are skipped, not fatal
+        while session.queue:
+            if voice_client.is_playing() or not voice_client.is_connected():
+                return  # Another start won, or the bot left
+
             # Play the next song
-            next_song_info = queue.pop(0)
-            currentSong = next_song_info
-            next_song_url = next_song_info['url']
+            next_song_info = session.queue.popleft()
+            log_track_id.set(next_song_info.id)
+            state_store.mark(guild.id)
+            previous = session.current
+            session.current = next_song_info
+            next_song_url = next_song_info.url
 
-            player = await YTDLSource.from_url(next_song_url, loop=bot.loop,volume=bot.current_volume.get(guild.id, 0.05))
+            dj_channel = await get_channel(guild)
+            try:
+                # Use the prefetched source when the head of the queue was resolved ahead of time
+                player = await prefetcher.take(guild.id, next_song_info)
+                if player is None:
+                    player = await YTDLSource.from_url(next_song_url, loop=bot.loop, volume=session.volume, guild_id=guild.id)
+            except Exception as e:
+                logger.info(f"Could not play {next_song_info.title}: {e}")
+                session.current = None
+                if dj_channel:
+                    notifier.send(dj_channel, f"Skipped {next_song_info.title}, it could not be played.")
+                continue
+
+            if voice_client.is_playing() or not voice_client.is_connected():
+                # Something started or the bot left while the song was resolved, keep it queued
+                player.cleanup()
+                session.queue.appendleft(next_song_info)
+                session.current = previous
+                return
 
             voice_client.play(player, after=lambda e: asyncio.run_coroutine_threadsafe(play_next_song(guild), bot.loop))
-            await bot.change_presence(status=discord.Status.online, activity=discord.Game(name=next_song_info['title']))
+            transition_seconds.observe(time.monotonic() - started)
+            prefetcher.schedule(guild)
+            audio_cache.record_play(player.data)
 
-            dj_channel = await get_channel(guild)
             if dj_channel:
-                if guessing_game_active.get(guild.id, False):
-                    await dj_channel.send(
-                        f"Now playing a new song for 'Guess the Song'! Clue: **{song_title_masked[guild.id]}**")
+                if session.game_active:
+                    notifier.now_playing(
+                        dj_channel, f"Now playing a new song for 'Guess the Song'! Clue: **{session.game_track.mask}**")
                 else:
-                    await dj_channel.send(f'Now playing: {next_song_info["title"]}')
+                    notifier.now_playing(dj_channel, f'Now playing: {next_song_info.title}')
 
             # Cancel the existing disconnect timer if playing music
-            if guild.id in bot.disconnect_timer:
-                bot.disconnect_timer[guild.id].cancel()
-                del bot.disconnect_timer[guild.id]
+            idle_scheduler.cancel(guild.id)
+            return
 
-        else:
-            # If no more songs in queue, start the disconnect timer
-            await bot.change_presence(status=discord.Status.online, activity=discord.Game(name="Use /play to use me."))
-            await start_disconnect_timer(guild)
+    if voice_client.is_playing():
+        return  # A concurrent start played the last queued song
+
+    # If no more songs in queue, start the disconnect timer
+    prefetcher.discard(guild.id)
+    await start_disconnect_timer(guild)
 
 async def get_channel(guild):
     # Get the channel name from the environment variable, with a default value of 'dj-remix'
@@ -536,50 +2269,115 @@ async def get_channel(guild):
     return None
 
 
-async def start_disconnect_timer(guild):
-    if guild.id not in bot.disconnect_timer:
-        bot.disconnect_timer[guild.id] = asyncio.create_task(disconnect_after_timeout(guild))
+class IdleScheduler:
+    # One task drives the inactivity deadlines of every guild. Deadlines sit in a hashed
+    # timer wheel of one-second slots, so arming, re-arming and cancelling are O(1)
+    def __init__(self, timeout, callback, slots=512):
+        self.timeout = timeout
+        self.callback = callback  # Coroutine function called with the guild id when a deadline passes
+        self.slots = [set() for _ in range(slots)]
+        self.deadlines = {}  # guild id -> deadline tick
+        self.last_tick = self._now()
+        self.wakeup = None  # Created in run(), on the bot's event loop
+
+    @staticmethod
+    def _now():
+        return int(time.monotonic())
+
+    def is_armed(self, guild_id):
+        return guild_id in self.deadlines
+
+    def arm(self, guild_id):
+        # (Re)start the guild's countdown
+        self.cancel(guild_id)
+        deadline = self._now() + max(1, int(self.timeout))
+        self.deadlines[guild_id] = deadline
+        self.slots[deadline % len(self.slots)].add(guild_id)
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def cancel(self, guild_id):
+        deadline = self.deadlines.pop(guild_id, None)
+        if deadline is not None:
+            self.slots[deadline % len(self.slots)].discard(guild_id)
+
+    async def run(self):
+        self.wakeup = asyncio.Event()
+        while True:
+            if not self.deadlines:
+                # Nothing to time, sleep until a guild is armed
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                self.last_tick = self._now()
+
+            # Process every tick since the last pass, a slot holds deadlines of later rounds too
+            now = self._now()
+            for tick in range(self.last_tick + 1, now + 1):
+                slot = self.slots[tick % len(self.slots)]
+                expired = [guild_id for guild_id in slot if self.deadlines[guild_id] <= tick]
+                for guild_id in expired:
+                    self.cancel(guild_id)
+                    asyncio.create_task(self.callback(guild_id))
+            self.last_tick = now
+
+            await asyncio.sleep(1 - time.monotonic() % 1)
 
 
-async def reset_disconnect_timer(guild):
-    if guild.id in bot.disconnect_timer:
-        bot.disconnect_timer[guild.id].cancel()  # Cancel existing timer
-        del bot.disconnect_timer[guild.id]  # Remove the entry
-    await start_disconnect_timer(guild)  # Restart the timer
+async def start_disconnect_timer(guild):
+    if not idle_scheduler.is_armed(guild.id):
+        idle_scheduler.arm(guild.id)
 
 
-async def disconnect_after_timeout(guild):
-    logger.debug('Timer started')
-    global disconnected
-    await asyncio.sleep(120)  # 2 minutes
-    logger.debug('2 min passed')
-    voice_client = guild.voice_client
-    # Ensure voice_client exists and is not playing any song
-    if voice_client and not voice_client.is_playing() and len(bot.song_queue.get(guild.id, [])) == 0:
-        disconnected = True
-        logger.info('No song in queue and bot not playing. Disconnecting.')
+async def reset_disconnect_timer(guild):
+    idle_scheduler.arm(guild.id)  # Restart the timer
+
+
+async def disconnect_after_timeout(guild_id):
+    logger.debug(f'{IDLE_TIMEOUT} s of inactivity passed')
+    guild = bot.get_guild(guild_id)
+    voice_client = guild.voice_client if guild else None
+    session = bot.get_session(guild_id)
+    # Ensure voice_client exists and is not playing any song, or that nobody is listening
+    idle = voice_client and not voice_client.is_playing() and len(session.queue) == 0
+    if voice_client and (idle or session.listeners == 0):
+        logger.info('No song in queue and bot not playing, or nobody listening. Disconnecting.')
+        prefetcher.discard(guild_id)
+        extraction.cancel_guild(guild_id)
+        session.paused_alone = False
+        state_store.mark(guild_id)
         await voice_client.disconnect()
         dj_channel = await get_channel(guild)
         if dj_channel:
-            await dj_channel.send("Disconnected due to inactivity.")
+            notifier.send(dj_channel, "Disconnected due to inactivity.")
     else:
         logger.info('Timer aborted: Either song is playing or queue is not empty.')
 
-# Check for empty voice channel
-async def check_voice_channel(guild):
-    logger.debug('Check voice channel started')
 
-    voice_client = guild.voice_client
-    if voice_client and len(voice_client.channel.members) == 1:  # Only bot is left in the channel
-        logger.info('Bot is alone. Disconnecting.')
-        await voice_client.disconnect()
-        dj_channel = await get_channel(guild)
-        if dj_channel:
-            await dj_channel.send("Disconnected because there are no users in the channel.")
+idle_scheduler = IdleScheduler(IDLE_TIMEOUT, disconnect_after_timeout)
+
+# Pause when the bot is left alone and pick up again when someone joins. The voice
+# connection and FFmpeg stay up; the idle timer disconnects if nobody comes back
+async def update_listening(guild, voice_client, session):
+    if session.listeners == 0:
+        if voice_client.is_playing():
+            logger.info('Bot is alone. Pausing.')
+            voice_client.pause()
+            session.paused_alone = True
+            dj_channel = await get_channel(guild)
+            if dj_channel:
+                notifier.send(dj_channel, "Paused because there are no users in the channel.")
+        await start_disconnect_timer(guild)
+
+    elif session.paused_alone and voice_client.is_paused():
+        logger.info('A listener joined. Resuming.')
+        voice_client.resume()
+        session.paused_alone = False
+        idle_scheduler.cancel(guild.id)
 
 
 # Function to check if the command is invoked in the correct channel
 async def check_channel(interaction):
+    log_guild_id.set(interaction.guild.id)
     dj_channel = await get_channel(interaction.guild)
     if interaction.channel != dj_channel:
         await interaction.response.send_message("This command can only be used in the dj-remix channel.",
@@ -588,11 +2386,142 @@ async def check_channel(interaction):
     return True
 
 
-# Retrieve the bot token from the environment variable
-bot_token = os.getenv('BOT')
-
-if not bot_token:
-    raise ValueError("No bot token found. Please set the BOT environment variable.")
-
-# Run the bot using the token from the environment
-bot.run(bot_token)
+def worker_path(path, index):
+    # bot.log -> bot-0.log
+    root, ext = os.path.splitext(path)
+    return f"{root}-{index}{ext}"
+
+
+class Supervisor:
+    # Runs the worker processes of the sharded mode and restarts any that exits. Every worker
+    # serves its own metrics on METRICS_PORT + 1 + its index; the supervisor's endpoint on
+    # METRICS_PORT merges them, labelling each sample with the worker it came from
+    def __init__(self, workers):
+        self.workers = workers
+        self.processes = {}  # worker index -> running process
+        self.restarts = [0] * workers
+        self.stopping = False
+
+    def worker_port(self, index):
+        return METRICS_PORT + 1 + index if METRICS_PORT else 0
+
+    def worker_env(self, index):
+        # Files are per worker: each one only saves its own guilds, and the audio cache budget
+        # is split so all workers together stay within AUDIO_CACHE_MAX_MB
+        env = dict(os.environ, WORKERS=str(self.workers), SHARD_COUNT=str(SHARD_COUNT), WORKER_INDEX=str(index),
+                   METRICS_PORT=str(self.worker_port(index)), LOG_FILE=worker_path(LOG_FILE, index))
+        if STATE_DB:
+            env['STATE_DB'] = worker_path(STATE_DB, index)
+        if AUDIO_CACHE_DIR:
+            env['AUDIO_CACHE_DIR'] = os.path.join(AUDIO_CACHE_DIR, f"worker-{index}")
+            env['AUDIO_CACHE_MAX_MB'] = str(AUDIO_CACHE_MAX_MB // self.workers)
+        return env
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop)
+        if METRICS_PORT:
+            await asyncio.start_server(lambda reader, writer: handle_http(reader, writer, self.http_response),
+                                       '0.0.0.0', METRICS_PORT)
+        logger.info(f"Supervising {self.workers} workers for {SHARD_COUNT} shards")
+        await asyncio.gather(*(self.keep_running(index) for index in range(self.workers)))
+
+    async def keep_running(self, index):
+        failures = 0
+        while not self.stopping:
+            started = time.monotonic()
+            process = await asyncio.create_subprocess_exec(sys.executable, os.path.abspath(__file__),
+                                                           env=self.worker_env(index))
+            self.processes[index] = process
+            logger.info(f"Started worker {index} (pid {process.pid})")
+            code = await process.wait()
+            if self.stopping:
+                break
+
+            # Back off while a worker keeps failing right after starting
+            failures = failures + 1 if time.monotonic() - started < 60 else 0
+            delay = min(300, WORKER_RESTART_DELAY * 2 ** max(0, failures - 1))
+            self.restarts[index] += 1
+            logger.warning(f"Worker {index} exited with code {code}, restarting in {delay:.0f} s")
+            await asyncio.sleep(delay)
+
+    def stop(self):
+        # SIGINT lets each worker close its bot and save its sessions
+        self.stopping = True
+        for process in self.processes.values():
+            if process.returncode is None:
+                process.send_signal(signal.SIGINT)
+
+    async def fetch(self, index, path):
+        # (status code, body) of a worker's HTTP endpoint, (None, '') when it does not answer
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection('127.0.0.1', self.worker_port(index)), timeout=2)
+            writer.write(f"GET {path} HTTP/1.0\r\n\r\n".encode())
+            response = await asyncio.wait_for(reader.read(), timeout=5)
+            writer.close()
+        except (asyncio.TimeoutError, OSError):
+            return None, ''
+        head, _, body = response.partition(b'\r\n\r\n')
+        try:
+            return int(head.split()[1]), body.decode()
+        except (IndexError, ValueError):
+            return None, ''  # Closed without a proper response
+
+
+    async def http_response(self, path):
+        results = await asyncio.gather(*(self.fetch(index, path) for index in range(self.workers)))
+        if path == '/metrics':
+            return '200 OK', self.merge_metrics([body for _, body in results])
+        if path in ('/healthz', '/ready'):
+            failing = [str(index) for index, (status, _) in enumerate(results) if status != 200]
+            if failing:
+                return '503 Service Unavailable', f"workers {', '.join(failing)} failing\n"
+            return '200 OK', 'ok\n' if path == '/healthz' else 'ready\n'
+        return '404 Not Found', 'not found\n'
+
+    def merge_metrics(self, bodies):
+        families = OrderedDict()  # metric name -> (HELP and TYPE lines, samples)
+        for index, body in enumerate(bodies):
+            label = f'worker="{index}"'
+            family = None
+            for line in body.splitlines():
+                if line.startswith('# '):
+                    family = families.setdefault(line.split()[2], ([], []))
+                    if line not in family[0]:
+                        family[0].append(line)
+                elif line and family is not None:
+                    name, _, value = line.rpartition(' ')
+                    if name.endswith('}'):
+                        name = f"{name[:-1]},{label}}}"
+                    else:
+                        name = f"{name}{{{label}}}"
+                    family[1].append(f"{name} {value}")
+
+        lines = ['# HELP beatsync_worker_up Whether the worker process is running', '# TYPE beatsync_worker_up gauge']
+        for index in range(self.workers):
+            process = self.processes.get(index)
+            lines.append(f'beatsync_worker_up{{worker="{index}"}} {int(process is not None and process.returncode is None)}')
+        lines += ['# HELP beatsync_worker_restarts_total Worker process restarts',
+                  '# TYPE beatsync_worker_restarts_total counter']
+        lines += [f'beatsync_worker_restarts_total{{worker="{index}"}} {count}' for index, count in enumerate(self.restarts)]
+        for headers, samples in families.values():
+            lines += headers + samples
+        return "\n".join(lines) + "\n"
+
+
+if __name__ == '__main__':
+    # Retrieve the bot token from the environment variable
+    bot_token = os.getenv('BOT')
+
+    if not bot_token:
+        raise ValueError("No bot token found. Please set the BOT environment variable.")
+
+    if SUPERVISOR:
+        asyncio.run(Supervisor(min(WORKERS, SHARD_COUNT)).run())
+    else:
+        # Run the bot using the token from the environment
+        startup_phase('import')
+        # Leave discord.py's logs to the queue handler instead of its own console handler
+        bot.run(bot_token, log_handler=None)